@@ -6,23 +6,107 @@ Guarda este archivo como software_profesional_final.py y asegúrate de tener:
    clear.png, excel.png, pdf.png, clean.png, auditoria.png, user.png, logout.png
  - pip install tkcalendar pillow pandas reportlab openpyxl folium
 """
+import time
+_T_INICIO = time.perf_counter()
 import os
 import sys
 import sqlite3
+import importlib
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, simpledialog
-from tkcalendar import DateEntry
-from PIL import Image, ImageTk
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import LETTER
-import pandas as pd
 import hashlib
 import datetime
 import json
+import re
+import math
 import webbrowser
 import tempfile
-import folium
+import html
 import threading
+import queue
+import contextlib
+import csv
+import gzip
+import zlib
+import atexit
+import textwrap
+import multiprocessing
+import concurrent.futures
+import collections
+import random
+import platform
+
+# -----------------------
+# Arranque: importaciones diferidas y servicios
+# -----------------------
+_ETAPAS_ARRANQUE = [("importaciones", time.perf_counter())]
+_CARGAS_DIFERIDAS = []
+PERFIL_ARRANQUE = "--perfil-arranque" in sys.argv
+
+class _ModuloPerezoso:
+    """Importa un módulo (o uno de sus atributos) la primera vez que se usa."""
+    def __init__(self, modulo, atributo=None):
+        self.__dict__.update(_modulo=modulo, _atributo=atributo, _objeto=None)
+
+    def _cargar(self):
+        if self._objeto is None:
+            t0 = time.perf_counter()
+            objeto = importlib.import_module(self._modulo)
+            if self._atributo:
+                objeto = getattr(objeto, self._atributo)
+            self.__dict__["_objeto"] = objeto
+            _CARGAS_DIFERIDAS.append((self._atributo or self._modulo, time.perf_counter() - t0))
+        return self._objeto
+
+    def __getattr__(self, nombre):
+        return getattr(self._cargar(), nombre)
+
+    def __call__(self, *args, **kwargs):
+        return self._cargar()(*args, **kwargs)
+
+pd = _ModuloPerezoso("pandas")
+np = _ModuloPerezoso("numpy")
+folium = _ModuloPerezoso("folium")
+canvas = _ModuloPerezoso("reportlab.pdfgen.canvas")
+Image = _ModuloPerezoso("PIL.Image")
+ImageTk = _ModuloPerezoso("PIL.ImageTk")
+DateEntry = _ModuloPerezoso("tkcalendar", "DateEntry")
+plt = _ModuloPerezoso("matplotlib.pyplot")
+FigureCanvasTkAgg = _ModuloPerezoso("matplotlib.backends.backend_tkagg", "FigureCanvasTkAgg")
+LETTER = (612.0, 792.0)  # reportlab.lib.pagesizes.LETTER, sin importar reportlab
+
+def marcar_arranque(etapa):
+    _ETAPAS_ARRANQUE.append((etapa, time.perf_counter()))
+
+def reporte_arranque():
+    lineas, previo = [], _T_INICIO
+    for etapa, t in _ETAPAS_ARRANQUE:
+        lineas.append(f"  {etapa:<22}{(t - previo) * 1000:8.1f} ms")
+        previo = t
+    lineas.append(f"  {'total':<22}{(previo - _T_INICIO) * 1000:8.1f} ms")
+    for nombre, seg in _CARGAS_DIFERIDAS:
+        lineas.append(f"  import {nombre:<15}{seg * 1000:8.1f} ms (diferido)")
+    return "Arranque:\n" + "\n".join(lineas)
+
+_SERVICIOS_SESION = []
+_sesion_iniciada = False
+
+def al_iniciar_sesion(servicio):
+    # Registra un servicio de fondo (backups, monitores) que sólo arranca tras un login correcto.
+    _SERVICIOS_SESION.append(servicio)
+    if _sesion_iniciada:
+        servicio()
+
+def iniciar_servicios_sesion():
+    global _sesion_iniciada
+    if _sesion_iniciada:
+        return
+    _sesion_iniciada = True
+    for servicio in _SERVICIOS_SESION:
+        try:
+            servicio()
+        except Exception as e:
+            print(f"Error iniciando {getattr(servicio, '__name__', servicio)}:", e)
 
 # -----------------------
 # Configuración global
@@ -33,6 +117,14 @@ current_user = None
 MAX_DETENIDOS = 10
 MAX_VEHICULOS = 10
 BACKUP_DAILY = True
+BACKUP_FOLDER = "backups"
+BACKUP_INCREMENTAL_ESPERA = 60   # segundos para agrupar ráfagas de altas en un solo backup
+BACKUP_RETENCION_DIAS = 30
+BACKUP_BLOQUE = 64 * 1024         # múltiplo del tamaño de página de SQLite
+BACKUP_INSTANTANEAS = 60          # instantáneas que conserva el almacén deduplicado
+CACHE_REGISTROS = 2000            # IPH recientes que se guardan en memoria para ver el detalle
+CENTRAL_CONFIG = "central.json"   # destino de la sincronización; sin este archivo sólo se acumula la bandeja
+ESTADOS_PROCESALES = ["En trámite", "Judicializado", "Vinculado a proceso", "Archivado", "Concluido"]
 
 # -----------------------
 # Helpers
@@ -44,7 +136,103 @@ def resource_path(relative):
         base = os.path.abspath(".")
     return os.path.join(base, relative)
 
-def cargar_icono(nombre, size=(64,64)):
+def carpeta_datos_usuario(*sub):
+    # Carpeta persistente por usuario para caches: en un ejecutable congelado resource_path apunta
+    # a _MEIPASS, que se vacía en cada arranque.
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    ruta = os.path.join(base, "IPH", *sub)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+def _firma_icono(ruta):
+    # Por contenido: al extraer un ejecutable congelado los originales cambian de fecha en cada arranque.
+    try:
+        with open(ruta, "rb") as f:
+            datos = f.read()
+    except OSError:
+        return None
+    return [len(datos), hashlib.sha1(datos).hexdigest()]
+
+def _construir_atlas(nombres, size, png, manifiesto):
+    # Redimensiona cada PNG una sola vez y los pega en una tira horizontal; el manifiesto guarda
+    # la posición de cada icono y la firma (tamaño, sha1) del original para detectar cambios.
+    ancho, alto = size
+    iconos, recortes = {}, []
+    for nombre in nombres:
+        ruta = resource_path(os.path.join(ICON_FOLDER, nombre))
+        entrada = {"firma": _firma_icono(ruta), "x": None}
+        if entrada["firma"]:
+            try:
+                recortes.append((nombre, Image.open(ruta).convert("RGBA").resize(size, Image.LANCZOS)))
+                entrada["x"] = (len(recortes) - 1) * ancho
+            except Exception:
+                pass
+        iconos[nombre] = entrada
+    atlas = Image.new("RGBA", (max(len(recortes), 1) * ancho, alto))
+    for i, (_, img) in enumerate(recortes):
+        atlas.paste(img, (i * ancho, 0))
+    os.makedirs(os.path.dirname(png), exist_ok=True)
+    atlas.save(png + ".tmp", format="PNG")
+    os.replace(png + ".tmp", png)
+    with open(manifiesto + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"tam": list(size), "iconos": iconos}, f)
+    os.replace(manifiesto + ".tmp", manifiesto)
+    return iconos
+
+def _nombres_en_manifiesto(manifiesto):
+    try:
+        with open(manifiesto, encoding="utf-8") as f:
+            return list(json.load(f)["iconos"])
+    except (OSError, ValueError, KeyError):
+        return []
+
+def cargar_iconos(nombres, size=(64,64)):
+    # {nombre: PhotoImage o None}. Camino rápido: un solo PNG ya escalado que Tk decodifica sin PIL,
+    # recortado con "copy -from". Se reconstruye si cambia, aparece o falta algún original.
+    base = os.path.join(carpeta_datos_usuario("iconos"), f"atlas_{size[0]}x{size[1]}")
+    png, manifiesto = base + ".png", base + ".json"
+    iconos = None
+    try:
+        with open(manifiesto, encoding="utf-8") as f:
+            iconos = json.load(f)["iconos"]
+        if not os.path.exists(png) or any(n not in iconos for n in nombres) or any(
+                _firma_icono(resource_path(os.path.join(ICON_FOLDER, n))) != e["firma"] for n, e in iconos.items()):
+            iconos = None
+    except (OSError, ValueError, KeyError):
+        iconos = None
+    for _ in range(2):
+        if iconos is None:
+            todos = sorted(set(nombres) | set(_nombres_en_manifiesto(manifiesto)))
+            try:
+                iconos = _construir_atlas(todos, size, png, manifiesto)
+            except OSError:
+                break
+        try:
+            atlas = tk.PhotoImage(file=png)
+            break
+        except tk.TclError:
+            # PNG de la caché dañado (p.ej. truncado): se borra y se reconstruye una sola vez
+            for ruta in (png, manifiesto):
+                try: os.remove(ruta)
+                except OSError: pass
+            iconos = None
+    if iconos is None:
+        return {n: cargar_icono_sin_cache(n, size) for n in nombres}
+    resultado = {}
+    for nombre in nombres:
+        x = iconos[nombre]["x"]
+        if x is None:
+            resultado[nombre] = None
+            continue
+        img = tk.PhotoImage(width=size[0], height=size[1])
+        img.tk.call(img, "copy", atlas, "-from", x, 0, x + size[0], size[1], "-to", 0, 0)
+        resultado[nombre] = img
+    return resultado
+
+def cargar_icono_sin_cache(nombre, size=(64,64)):
     ruta = resource_path(os.path.join(ICON_FOLDER, nombre))
     if os.path.exists(ruta):
         try:
@@ -55,15 +243,96 @@ def cargar_icono(nombre, size=(64,64)):
             return None
     return None
 
+def cargar_icono(nombre, size=(64,64)):
+    return cargar_iconos([nombre], size)[nombre]
+
 def hash_password(pw):
     return hashlib.sha256(pw.encode()).hexdigest()
 
 # -----------------------
 # Base de datos
 # -----------------------
+class PoolConexiones:
+    """Conexiones SQLite reutilizables para un archivo (WAL); cada conexión la usa un solo hilo a la vez."""
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",      # seguro con WAL, sin fsync por commit
+        "PRAGMA cache_size=-20000",       # ~20 MB por conexión
+        "PRAGMA mmap_size=268435456",     # 256 MB
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA busy_timeout=10000",
+    )
+
+    def __init__(self, ruta, max_libres=4):
+        self.ruta = ruta
+        self.libres = queue.LifoQueue(maxsize=max_libres)
+        conn = self._crear()
+        with conn:
+            crear_esquema(conn.cursor())  # una sola vez por archivo
+        self.devolver(conn)
+
+    def _crear(self):
+        conn = sqlite3.connect(self.ruta, timeout=10, check_same_thread=False)
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("distancia_km", 4, distancia_km, deterministic=True)
+        return conn
+
+    def tomar(self):
+        try:
+            return self.libres.get_nowait()
+        except queue.Empty:
+            return self._crear()
+
+    def devolver(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.libres.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def cerrar(self):
+        while True:
+            try:
+                self.libres.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _pool(ruta=None):
+    ruta = os.path.abspath(ruta or resource_path(DB_NAME))
+    with _pools_lock:
+        pool = _pools.get(ruta)
+        if pool is None:
+            pool = _pools[ruta] = PoolConexiones(ruta)
+        return pool
+
+def _cerrar_pool(ruta):
+    # Cierra las conexiones libres de un archivo (p. ej. una instantánea que se va a borrar).
+    with _pools_lock:
+        pool = _pools.pop(os.path.abspath(ruta), None)
+    if pool is not None:
+        pool.cerrar()
+
+@contextlib.contextmanager
+def conexion_db(ruta=None):
+    # Presta una conexión del pool; confirma al salir sin errores y revierte si hubo excepción.
+    pool = _pool(ruta)
+    conn = pool.tomar()
+    try:
+        yield conn
+        if conn.in_transaction: conn.commit()
+    finally:
+        pool.devolver(conn)
+
 def conectar_db():
-    conn = sqlite3.connect(resource_path(DB_NAME))
-    cur = conn.cursor()
+    # Garantiza que el esquema existe (sólo la primera llamada por archivo toca la base).
+    _pool()
+
+def crear_esquema(cur):
     cur.execute("""
         CREATE TABLE IF NOT EXISTS iph (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -103,44 +372,1198 @@ def conectar_db():
             cambios TEXT
         )
     """)
-    conn.commit()
-    conn.close()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            accion TEXT, tabla TEXT,
+            registro_id INTEGER, usuario TEXT, fecha TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_iph_fecha ON iph(fecha_hechos DESC, id DESC)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_iph_tipo ON iph(tipo_hecho COLLATE NOCASE)")
+    crear_tablas_detenidos_vehiculos(cur)
+    crear_indice_busqueda(cur)
+    crear_registro_cambios(cur)
+    crear_bandeja_salida(cur)
+    crear_indice_espacial(cur)
+    crear_estadisticas(cur)
+
+def _tabla_existe(cur, nombre):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name=?", (nombre,))
+    return cur.fetchone() is not None
+
+def columnas_iph(conn, alias=""):
+    # Columnas guardadas de iph (table_info omite las generadas lat/lon): lo que exportan los volcados.
+    return ", ".join(alias + fila[1] for fila in conn.execute("PRAGMA table_info(iph)"))
+
+# -----------------------
+# Detenidos y vehículos (tablas hijas de iph)
+# -----------------------
+def crear_tablas_detenidos_vehiculos(cur):
+    # Las columnas *_json se conservan para la tabla y el índice FTS; las búsquedas por placa,
+    # serie o nombre van contra estas tablas indexadas.
+    migrar = not _tabla_existe(cur, "detenidos")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS detenidos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            iph_id INTEGER NOT NULL REFERENCES iph(id) ON DELETE CASCADE,
+            nombre TEXT,
+            sexo TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS vehiculos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            iph_id INTEGER NOT NULL REFERENCES iph(id) ON DELETE CASCADE,
+            tipo TEXT,
+            marca TEXT,
+            placa TEXT,
+            serie TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_det_iph ON detenidos(iph_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_det_nombre ON detenidos(nombre COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_veh_iph ON vehiculos(iph_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_veh_placa ON vehiculos(placa COLLATE NOCASE)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_veh_serie ON vehiculos(serie COLLATE NOCASE)")
+    # foreign_keys está apagado por defecto en SQLite: el borrado en cascada lo hace este trigger
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_hijos_ad AFTER DELETE ON iph BEGIN "
+                "DELETE FROM detenidos WHERE iph_id = old.id; DELETE FROM vehiculos WHERE iph_id = old.id; END")
+    if migrar:
+        # migración única desde los blobs JSON existentes
+        cur.execute("""
+            INSERT INTO detenidos (iph_id, nombre, sexo)
+            SELECT i.id, json_extract(j.value,'$.nombre'), json_extract(j.value,'$.sexo')
+            FROM iph i, json_each(CASE WHEN json_valid(i.detenidos_json) THEN i.detenidos_json ELSE '[]' END) j
+            WHERE j.type = 'object'
+        """)
+        cur.execute("""
+            INSERT INTO vehiculos (iph_id, tipo, marca, placa, serie)
+            SELECT i.id, json_extract(j.value,'$.tipo'), json_extract(j.value,'$.marca'),
+                   json_extract(j.value,'$.placa'), json_extract(j.value,'$.serie')
+            FROM iph i, json_each(CASE WHEN json_valid(i.vehiculos_json) THEN i.vehiculos_json ELSE '[]' END) j
+            WHERE j.type = 'object'
+        """)
+
+def guardar_detenidos_vehiculos(cur, iph_id, detenidos, vehiculos):
+    # Reemplaza las filas hijas de un IPH (dentro de la transacción del llamador).
+    guardar_hijos_lote(cur, [(iph_id, detenidos, vehiculos)])
+
+def guardar_hijos_lote(cur, hijos):
+    # hijos: [(iph_id, detenidos, vehiculos)]; dos DELETE y dos executemany para todo el lote.
+    ids = json.dumps([i for i, _, _ in hijos])
+    cur.execute("DELETE FROM detenidos WHERE iph_id IN (SELECT value FROM json_each(?))", (ids,))
+    cur.execute("DELETE FROM vehiculos WHERE iph_id IN (SELECT value FROM json_each(?))", (ids,))
+    cur.executemany("INSERT INTO detenidos (iph_id, nombre, sexo) VALUES (?,?,?)",
+                    [(i, d.get("nombre",""), d.get("sexo","")) for i, dets, _ in hijos
+                     for d in dets or [] if isinstance(d, dict)])
+    cur.executemany("INSERT INTO vehiculos (iph_id, tipo, marca, placa, serie) VALUES (?,?,?,?,?)",
+                    [(i, v.get("tipo",""), v.get("marca",""), v.get("placa",""), v.get("serie",""))
+                     for i, _, vehs in hijos for v in vehs or [] if isinstance(v, dict)])
+
+def _buscar_iph_por_hijo(tabla, campo, valor):
+    sql = (f"SELECT DISTINCT i.id, i.numero_informe, i.fecha_hechos, i.tipo_hecho FROM {tabla} h "
+           f"JOIN iph i ON i.id = h.iph_id WHERE h.{campo} = ? COLLATE NOCASE ORDER BY i.fecha_hechos DESC")
+    with conexion_db() as conn:
+        return conn.execute(sql, ((valor or "").strip(),)).fetchall()
+
+def buscar_iph_por_placa(placa):
+    return _buscar_iph_por_hijo("vehiculos", "placa", placa)
+
+def buscar_iph_por_serie(serie):
+    return _buscar_iph_por_hijo("vehiculos", "serie", serie)
+
+def buscar_iph_por_detenido(nombre):
+    return _buscar_iph_por_hijo("detenidos", "nombre", nombre)
+
+# -----------------------
+# Búsqueda indexada (FTS5)
+# -----------------------
+# Columnas que muestra la tabla del dashboard, en orden.
+IPH_COLUMNAS_TABLA = ("id","numero_informe","fecha_hechos","denunciante","tipo_hecho","tipo_delito","lugar","autoridad",
+                      "detenidos_json","vehiculos_json","victima","coordenadas","estado_procesal","observaciones","creado_en")
+# Filas de búsqueda: columnas de la tabla + lo que sólo usa el detalle (la tabla ignora las últimas).
+IPH_COLUMNAS_DETALLE = IPH_COLUMNAS_TABLA + ("puesta_a_disposicion", "capturado_por")
+
+# Nombres de detenidos concatenados a partir del JSON de la fila (new/old dentro de los triggers).
+_FTS_NOMBRES_DET = ("(SELECT group_concat(json_extract(value,'$.nombre'),' ') FROM json_each("
+                    "CASE WHEN json_valid({0}.detenidos_json) THEN {0}.detenidos_json ELSE '[]' END))")
+
+def _fts_insert_sql(alias):
+    return (f"INSERT INTO iph_fts(rowid, numero_informe, denunciante, tipo_hecho, lugar, victima, detenidos) "
+            f"VALUES ({alias}.id, {alias}.numero_informe, {alias}.denunciante, {alias}.tipo_hecho, {alias}.lugar, "
+            f"{alias}.victima, {_FTS_NOMBRES_DET.format(alias)});")
+
+def crear_indice_busqueda(cur):
+    # Índice FTS5 sobre iph; los triggers lo mantienen al insertar, borrar o actualizar (importación JSON).
+    existia = _tabla_existe(cur, "iph_fts")
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS iph_fts USING fts5(
+            numero_informe, denunciante, tipo_hecho, lugar, victima, detenidos,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_fts_ai AFTER INSERT ON iph BEGIN " + _fts_insert_sql("new") + " END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_fts_ad AFTER DELETE ON iph BEGIN "
+                "DELETE FROM iph_fts WHERE rowid = old.id; END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_fts_au AFTER UPDATE ON iph BEGIN "
+                "DELETE FROM iph_fts WHERE rowid = old.id; " + _fts_insert_sql("new") + " END")
+    if not existia:
+        # primera vez: indexar los registros que ya existían
+        cur.execute("INSERT INTO iph_fts(rowid, numero_informe, denunciante, tipo_hecho, lugar, victima, detenidos) "
+                    "SELECT i.id, i.numero_informe, i.denunciante, i.tipo_hecho, i.lugar, i.victima, "
+                    + _FTS_NOMBRES_DET.format("i") + " FROM iph i")
+
+# -----------------------
+# Índice espacial (R*Tree)
+# -----------------------
+_LAT_TXT = "trim(substr(coordenadas, 1, instr(coordenadas, ',') - 1))"
+_LON_TXT = "trim(substr(coordenadas, instr(coordenadas, ',') + 1))"
+_COORD_VALIDA = " AND ".join([
+    "instr(coordenadas, ',') > 0",
+    *(f"{p} GLOB '*[0-9]*' AND {p} NOT GLOB '*[^0-9.+-]*'" for p in (_LAT_TXT, _LON_TXT)),
+    f"abs(CAST({_LAT_TXT} AS REAL)) <= 90", f"abs(CAST({_LON_TXT} AS REAL)) <= 180",
+])
+
+def crear_indice_espacial(cur):
+    # lat/lon son columnas generadas a partir de "lat, lon" (NULL si el texto no es válido);
+    # iph_geo es un R*Tree de puntos que mantienen los triggers.
+    columnas = {fila[1] for fila in cur.execute("PRAGMA table_xinfo(iph)")}
+    if "lat" not in columnas:
+        cur.execute(f"ALTER TABLE iph ADD COLUMN lat REAL GENERATED ALWAYS AS "
+                    f"(CASE WHEN {_COORD_VALIDA} THEN CAST({_LAT_TXT} AS REAL) END) VIRTUAL")
+        cur.execute(f"ALTER TABLE iph ADD COLUMN lon REAL GENERATED ALWAYS AS "
+                    f"(CASE WHEN {_COORD_VALIDA} THEN CAST({_LON_TXT} AS REAL) END) VIRTUAL")
+    existia = _tabla_existe(cur, "iph_geo")
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS iph_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    insertar = "INSERT INTO iph_geo SELECT new.id, new.lat, new.lat, new.lon, new.lon WHERE new.lat IS NOT NULL;"
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_geo_ai AFTER INSERT ON iph BEGIN " + insertar + " END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_geo_au AFTER UPDATE OF coordenadas ON iph BEGIN "
+                "DELETE FROM iph_geo WHERE id = old.id; " + insertar + " END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS iph_geo_ad AFTER DELETE ON iph BEGIN "
+                "DELETE FROM iph_geo WHERE id = old.id; END")
+    if not existia:
+        cur.execute("INSERT INTO iph_geo SELECT id, lat, lat, lon, lon FROM iph WHERE lat IS NOT NULL")
+
+_PARTE_COORD = re.compile(r"[0-9.+-]*[0-9][0-9.+-]*")          # GLOB de _COORD_VALIDA
+_PREFIJO_REAL = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)")  # lo que toma CAST(... AS REAL)
+
+def coordenadas_de_texto(texto):
+    # Misma regla que las columnas generadas: "lat, lon" -> (lat, lon) o None. Sólo dígitos, punto y
+    # signo (nada de "1e1", "nan" o "inf") y, como CAST en SQLite, se toma el prefijo numérico ("1.2.3" -> 1.2).
+    partes = (texto or "").split(",", 1)
+    if len(partes) != 2:
+        return None
+    valores = []
+    for parte in partes:
+        parte = parte.strip(" ")
+        if not _PARTE_COORD.fullmatch(parte):
+            return None
+        m = _PREFIJO_REAL.match(parte)
+        valores.append(float(m.group()) if m else 0.0)
+    lat, lon = valores
+    return (lat, lon) if abs(lat) <= 90 and abs(lon) <= 180 else None
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    # Haversine; también registrada como función SQL en cada conexión del pool.
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(min(1.0, math.sqrt(a)))
+
+def _caja_radio(lat, lon, km):
+    dlat = km / 110.574
+    dlon = km / (111.320 * max(math.cos(math.radians(lat)), 1e-6))
+    return max(lat - dlat, -90), min(lat + dlat, 90), max(lon - dlon, -180), min(lon + dlon, 180)
+
+# El R*Tree guarda float32 redondeado hacia afuera: sólo sirve de prefiltro por solapamiento (nunca pierde
+# un punto del borde) y el predicado exacto va sobre i.lat/i.lon. Parámetros: lat_min, lat_max, lon_min, lon_max.
+_CAJA_GEO = "g.max_lat >= ? AND g.min_lat <= ? AND g.max_lon >= ? AND g.min_lon <= ?"
+_CAJA_EXACTA = "i.lat BETWEEN ? AND ? AND i.lon BETWEEN ? AND ?"
+
+def buscar_iph_en_caja(lat_min, lat_max, lon_min, lon_max, limite=None):
+    sql = ("SELECT " + ", ".join("i." + c for c in IPH_COLUMNAS_TABLA) + " FROM iph_geo g JOIN iph i ON i.id = g.id "
+           f"WHERE {_CAJA_GEO} AND {_CAJA_EXACTA} ORDER BY i.fecha_hechos DESC, i.id DESC")
+    params = [lat_min, lat_max, lon_min, lon_max] * 2
+    if limite:
+        sql += " LIMIT ?"; params.append(int(limite))
+    with conexion_db() as conn:
+        return conn.execute(sql, params).fetchall()
+
+def buscar_iph_en_radio(lat, lon, km, limite=None):
+    # Filas de IPH_COLUMNAS_TABLA + distancia en km, de la más cercana a la más lejana.
+    # El R*Tree acota a la caja que contiene el círculo; distancia_km descarta las esquinas.
+    sql = ("SELECT " + ", ".join("i." + c for c in IPH_COLUMNAS_TABLA) + ", distancia_km(i.lat, i.lon, ?, ?) AS d "
+           f"FROM iph_geo g JOIN iph i ON i.id = g.id WHERE {_CAJA_GEO} AND d <= ? ORDER BY d")
+    params = [lat, lon, *_caja_radio(lat, lon, km), km]
+    if limite:
+        sql += " LIMIT ?"; params.append(int(limite))
+    with conexion_db() as conn:
+        return conn.execute(sql, params).fetchall()
+
+def buscar_iph_cercanos(lat, lon, n=10, radio_inicial=1.0):
+    # Los n más cercanos: se duplica el radio hasta juntar n dentro del círculo (resultado exacto).
+    km = radio_inicial
+    while True:
+        filas = buscar_iph_en_radio(lat, lon, km, n)
+        if len(filas) >= n or km > 20040:
+            return filas
+        km *= 2
+
+def expresion_fts(term):
+    # "gomez iph-20" -> '"gomez"* AND "iph"* AND "20"*' (prefijo por palabra, sin operadores del usuario)
+    tokens = re.findall(r"\w+", term or "")
+    return " AND ".join(f'"{t}"*' for t in tokens)
+
+def buscar_iph(term="", tipo="", limite=None, despues=None, antes=None, cancelado=None, cerca=None, ids=None):
+    # Filtra en SQL: el término va contra iph_fts, el tipo contra idx_iph_tipo y cerca=(lat, lon, km) contra iph_geo.
+    # ids limita la búsqueda a esos registros (¿siguen cumpliendo el filtro tras un cambio?).
+    # despues/antes = (fecha_hechos, id) de la última/primera fila ya cargada (paginación keyset).
+    # cancelado() -> True aborta la consulta en curso (sqlite3.OperationalError "interrupted").
+    sql = "SELECT " + ", ".join("i."+c for c in IPH_COLUMNAS_DETALLE) + " FROM iph i"
+    where, params = [], []
+    expr = expresion_fts(term)
+    if expr:
+        # texto libre por FTS, o placa/serie exacta por los índices de vehiculos
+        where.append("(i.id IN (SELECT rowid FROM iph_fts WHERE iph_fts MATCH ?) OR i.id IN "
+                     "(SELECT iph_id FROM vehiculos WHERE placa = ? COLLATE NOCASE OR serie = ? COLLATE NOCASE))")
+        params.extend([expr, term.strip(), term.strip()])
+    tipo = (tipo or "").strip()
+    if tipo:
+        # prefijo sin distinguir mayúsculas ("rob" -> Robo); LIKE con parámetro usa idx_iph_tipo
+        where.append("i.tipo_hecho LIKE ? ESCAPE '\\'")
+        params.append(re.sub(r"([%_\\])", r"\\\1", tipo) + "%")
+    if cerca:
+        lat, lon, km = cerca
+        where.append(f"i.id IN (SELECT id FROM iph_geo g WHERE {_CAJA_GEO}) AND distancia_km(i.lat, i.lon, ?, ?) <= ?")
+        params.extend([*_caja_radio(lat, lon, km), lat, lon, km])
+    if ids is not None:
+        where.append("i.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(i) for i in ids]))
+    if despues:
+        where.append("(i.fecha_hechos, i.id) < (?, ?)")
+        params.extend(despues)
+    elif antes:
+        where.append("(i.fecha_hechos, i.id) > (?, ?)")
+        params.extend(antes)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    orden = "ASC" if antes and not despues else "DESC"
+    sql += f" ORDER BY i.fecha_hechos {orden}, i.id {orden}"
+    if limite:
+        sql += " LIMIT ?"
+        params.append(int(limite))
+    with conexion_db() as conn:
+        if cancelado:
+            conn.set_progress_handler(lambda: 1 if cancelado() else 0, 1000)
+        try:
+            filas = conn.execute(sql, params).fetchall()
+        finally:
+            if cancelado: conn.set_progress_handler(None, 0)
+    if orden == "ASC":
+        filas.reverse()
+    return filas
+
+class CacheRegistros:
+    """Últimos IPH leídos (LRU por id) para abrir el detalle sin volver a SQLite."""
+    def __init__(self, capacidad=CACHE_REGISTROS):
+        self.capacidad = capacidad
+        self.filas = collections.OrderedDict()   # id -> fila en orden IPH_COLUMNAS_DETALLE
+        self.lock = threading.Lock()             # lo llenan también los hilos de búsqueda
+
+    def guardar(self, filas):
+        with self.lock:
+            for r in filas:
+                self.filas[r[0]] = r
+                self.filas.move_to_end(r[0])
+            while len(self.filas) > self.capacidad:
+                self.filas.popitem(last=False)
+        return filas
+
+    def obtener(self, iph_id):
+        with self.lock:
+            r = self.filas.get(iph_id)
+            if r is not None: self.filas.move_to_end(iph_id)
+            return r
+
+    def leer(self, iph_id):
+        # Cache o, si no está, una sola fila por clave primaria.
+        r = self.obtener(iph_id)
+        if r is None:
+            with conexion_db() as conn:
+                r = conn.execute("SELECT " + ", ".join(IPH_COLUMNAS_DETALLE) + " FROM iph WHERE id=?",
+                                 (iph_id,)).fetchone()
+            if r is not None: self.guardar([r])
+        return r
+
+    def invalidar(self, *ids):
+        with self.lock:
+            for i in ids: self.filas.pop(i, None)
+
+    def vaciar(self):
+        with self.lock:
+            self.filas.clear()
+
+cache_registros = CacheRegistros()
+
+# -----------------------
+# Avisos de cambios en iph (para actualizar vistas fila a fila)
+# -----------------------
+_SUSCRIPTORES_IPH = []
+
+def suscribir_cambios_iph(fn):
+    # fn(operacion, filas): "I"/"U" con filas en IPH_COLUMNAS_DETALLE, "D" con la lista de ids.
+    # Se llama en el hilo que hizo el cambio. Devuelve la función que cancela la suscripción.
+    _SUSCRIPTORES_IPH.append(fn)
+    return lambda: fn in _SUSCRIPTORES_IPH and _SUSCRIPTORES_IPH.remove(fn)
+
+def notificar_cambio_iph(operacion, filas):
+    if not filas: return
+    for fn in list(_SUSCRIPTORES_IPH):
+        try:
+            fn(operacion, filas)
+        except Exception as e:
+            print("Error notificando cambio de IPH:", e)
+
+# -----------------------
+# Operaciones por lote sobre IPH seleccionados
+# -----------------------
+# Cada operación es una sola sentencia (ids en json_each) dentro de una transacción,
+# con una escritura de auditoría agrupada.
+_EN_IDS = "id IN (SELECT value FROM json_each(?))"
+
+def _ids_json(ids):
+    return json.dumps([int(i) for i in ids])
+
+def eliminar_iph_lote(ids):
+    # Devuelve [(id, numero_informe)] de los registros que existían y se borraron.
+    with conexion_db() as conn:
+        borrados = conn.execute(f"DELETE FROM iph WHERE {_EN_IDS} RETURNING id, numero_informe",
+                                (_ids_json(ids),)).fetchall()
+    cache_registros.invalidar(*(i for i, _ in borrados))
+    registrar_auditoria_lote("ELIMINAR", [n for _, n in borrados])
+    notificar_cambio_iph("D", [i for i, _ in borrados])
+    if borrados:
+        solicitar_backup_incremental()
+        avisar_sincronizacion()
+    return borrados
+
+def cambiar_estado_lote(ids, estado):
+    # Devuelve las filas actualizadas (IPH_COLUMNAS_DETALLE) para refrescar la tabla sin recargarla.
+    with conexion_db() as conn:
+        filas = conn.execute(f"UPDATE iph SET estado_procesal=? WHERE {_EN_IDS} RETURNING "
+                             + ", ".join(IPH_COLUMNAS_DETALLE), (estado, _ids_json(ids))).fetchall()
+    cache_registros.guardar(filas)
+    registrar_auditoria_lote("CAMBIAR_ESTADO", [r[1] for r in filas], estado)
+    notificar_cambio_iph("U", filas)
+    if filas:
+        solicitar_backup_incremental()
+        avisar_sincronizacion()
+    return filas
+
+def escribir_seleccion(path, ids, progreso=None, cancelar=None):
+    with conexion_db() as conn:
+        columnas = columnas_iph(conn)
+    return escribir_tabla(path, f"SELECT {columnas} FROM iph WHERE {_EN_IDS} ORDER BY id", (_ids_json(ids),),
+                          progreso, cancelar)
+
+# -----------------------
+# Estadísticas incrementales
+# -----------------------
+# (tabla, clave, expresión sobre la fila de iph)
+_STATS = (("stats_usuario", "usuario", "coalesce({f}.capturado_por, '')"),
+          ("stats_tipo", "tipo", "coalesce({f}.tipo_hecho, '')"),
+          ("stats_dia", "dia", "substr(coalesce({f}.fecha_hechos, ''), 1, 10)"),
+          ("stats_semana", "semana", "coalesce(date({f}.fecha_hechos, 'weekday 0', '-6 days'), '')"),  # lunes
+          ("stats_mes", "mes", "substr(coalesce({f}.fecha_hechos, ''), 1, 7)"))
+
+def crear_estadisticas(cur):
+    # Contadores por usuario, tipo y día mantenidos por triggers: leerlos cuesta O(grupos), no O(registros).
+    # primero/ultimo de stats_usuario guardan la actividad histórica (un borrado sólo descuenta el total).
+    nuevas = [t for t, _, _ in _STATS if not _tabla_existe(cur, t)]
+    cur.execute("CREATE TABLE IF NOT EXISTS stats_usuario (usuario TEXT PRIMARY KEY, total INTEGER NOT NULL, "
+                "primero TEXT, ultimo TEXT)")
+    for tabla, clave, _ in _STATS[1:]:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ({clave} TEXT PRIMARY KEY, total INTEGER NOT NULL)")
+    def sumar(f):
+        sql = ""
+        for tabla, clave, expr in _STATS:
+            if tabla == "stats_usuario":
+                sql += (f"INSERT INTO stats_usuario (usuario, total, primero, ultimo) "
+                        f"VALUES ({expr.format(f=f)}, 1, {f}.creado_en, {f}.creado_en) "
+                        f"ON CONFLICT(usuario) DO UPDATE SET total = total + 1, "
+                        f"primero = min(coalesce(primero, excluded.primero), coalesce(excluded.primero, primero)), "
+                        f"ultimo = max(coalesce(ultimo, excluded.ultimo), coalesce(excluded.ultimo, ultimo)); ")
+            else:
+                sql += (f"INSERT INTO {tabla} ({clave}, total) VALUES ({expr.format(f=f)}, 1) "
+                        f"ON CONFLICT({clave}) DO UPDATE SET total = total + 1; ")
+        return sql
+    def restar(f):
+        return "".join(f"UPDATE {tabla} SET total = total - 1 WHERE {clave} = {expr.format(f=f)}; "
+                       f"DELETE FROM {tabla} WHERE {clave} = {expr.format(f=f)} AND total <= 0; "
+                       for tabla, clave, expr in _STATS)
+    if nuevas:
+        # los triggers deben cubrir también las tablas recién agregadas
+        for trigger in ("stats_ai", "stats_ad", "stats_au"):
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS stats_ai AFTER INSERT ON iph BEGIN " + sumar("new") + "END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS stats_ad AFTER DELETE ON iph BEGIN " + restar("old") + "END")
+    cur.execute("CREATE TRIGGER IF NOT EXISTS stats_au AFTER UPDATE OF capturado_por, tipo_hecho, fecha_hechos ON iph "
+                "BEGIN " + restar("old") + sumar("new") + "END")
+    for tabla, _, expr in _STATS:
+        if tabla not in nuevas:
+            continue
+        extra = ", min(creado_en), max(creado_en)" if tabla == "stats_usuario" else ""
+        cur.execute(f"INSERT INTO {tabla} SELECT {expr.format(f='iph')}, count(*){extra} FROM iph GROUP BY 1")
+
+def marca_cambios():
+    # Último seq de la bitácora de cambios (AUTOINCREMENT no retrocede aunque se poden filas); O(1).
+    with conexion_db() as conn:
+        fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='iph_cambios'").fetchone()
+    return fila[0] if fila else 0
+
+def leer_estadisticas():
+    with conexion_db() as conn:
+        return {
+            "por_usuario": pd.read_sql_query("SELECT usuario, total, primero, ultimo FROM stats_usuario "
+                                             "ORDER BY total DESC", conn),
+            "por_tipo": pd.read_sql_query("SELECT tipo, total FROM stats_tipo ORDER BY total DESC", conn),
+            "por_dia": pd.read_sql_query("SELECT dia, total FROM stats_dia ORDER BY dia", conn),
+        }
+
+GRANULARIDADES = {"dia": ("stats_dia", "dia", "D", 10), "semana": ("stats_semana", "semana", "W-MON", 10),
+                  "mes": ("stats_mes", "mes", "MS", 7)}
+
+def serie_temporal(desde, hasta, granularidad="auto", max_puntos=120):
+    # Totales por periodo entre dos fechas "YYYY-MM-DD" leídos de los rollups (con ceros en los huecos).
+    # "auto" elige la granularidad más fina que quepa en max_puntos; si aun así sobran, se agrupan
+    # periodos consecutivos. Devuelve (DataFrame[periodo, total], granularidad usada).
+    inicio, fin = pd.Timestamp(desde), pd.Timestamp(hasta)
+    if granularidad == "auto":
+        dias = (fin - inicio).days + 1
+        granularidad = "dia" if dias <= max_puntos else "semana" if dias / 7 <= max_puntos else "mes"
+    tabla, clave, freq, largo = GRANULARIDADES[granularidad]
+    if granularidad == "semana":
+        inicio -= pd.Timedelta(days=inicio.weekday())
+    elif granularidad == "mes":
+        inicio = inicio.replace(day=1)
+    with conexion_db() as conn:
+        filas = conn.execute(f"SELECT {clave}, total FROM {tabla} WHERE {clave} BETWEEN ? AND ? ORDER BY {clave}",
+                             (str(inicio.date())[:largo], str(fin.date())[:largo])).fetchall()
+    serie = pd.Series({pd.Timestamp(k): t for k, t in filas}, dtype="int64")
+    serie = serie.reindex(pd.date_range(inicio, fin, freq=freq), fill_value=0)
+    if len(serie) > max_puntos:
+        paso = -(-len(serie) // max_puntos)
+        serie = serie.groupby(np.arange(len(serie)) // paso).sum().set_axis(serie.index[::paso])
+        granularidad += f" ×{paso}"
+    return serie.rename_axis("periodo").reset_index(name="total"), granularidad
+
+def rango_estadisticas():
+    # Primer y último día con registros (datetime.date), o (None, None). Se parsea con strptime como
+    # validar_fecha: "2024-1-5" es válida pero no ordena bien como texto, así que min/max van en Python.
+    with conexion_db() as conn:
+        dias = [d for (d,) in conn.execute("SELECT dia FROM stats_dia WHERE dia GLOB '[0-9]*'")]
+    fechas = []
+    for d in dias:
+        try:
+            fechas.append(datetime.datetime.strptime(d, "%Y-%m-%d").date())
+        except ValueError:
+            pass
+    return (min(fechas), max(fechas)) if fechas else (None, None)
+
+def escribir_estadisticas(archivo):
+    # Escribe a un temporal y lo reemplaza, para que nadie abra un xlsx a medio escribir.
+    stats = leer_estadisticas()
+    tmp = archivo + ".tmp.xlsx"
+    with pd.ExcelWriter(tmp) as writer:
+        stats["por_usuario"].to_excel(writer, sheet_name="Por Usuario", index=False)
+        stats["por_tipo"].to_excel(writer, sheet_name="Por Tipo", index=False)
+        stats["por_dia"].to_excel(writer, sheet_name="Por Día", index=False)
+    os.replace(tmp, archivo)
+    return stats
 
 # -----------------------
 # Auditoría y backup
 # -----------------------
+class ColaAuditoria:
+    """Escritor de auditoría en segundo plano: encola eventos y los vuelca por lotes en una sola transacción."""
+    _FIN = object()
+
+    def __init__(self, espera_max=0.5, lote=500):
+        self.espera_max = espera_max      # latencia máxima entre el evento y su escritura
+        self.lote = lote
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self.escritos = 0; self.ultimo_error = None
+
+    def _iniciar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._bucle, name="auditoria", daemon=True)
+                self._hilo.start()
+
+    def sql(self, sentencia, params):
+        # la base se fija al encolar: DB_NAME puede cambiar antes de que se vuelque el lote
+        self._iniciar()
+        self._cola.put((("sql", sentencia, os.path.abspath(resource_path(DB_NAME))), params))
+
+    def texto(self, ruta, linea):
+        self._iniciar()
+        self._cola.put((("txt", ruta), linea))
+
+    def _bucle(self):
+        # Lo que no se pudo escribir se conserva y se reintenta con espera creciente (hasta 30 s).
+        pendientes, fin, fallos = [], False, 0
+        while True:
+            if not pendientes:
+                item = self._cola.get()
+                if item is self._FIN:
+                    return
+                pendientes.append(item)
+            espera = min(30, self.espera_max * 2 ** fallos)
+            limite = time.monotonic() + espera
+            while not fin and (fallos or len(pendientes) < self.lote):
+                try:
+                    item = self._cola.get(timeout=max(0, limite - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is self._FIN:
+                    fin = True; break
+                pendientes.append(item)
+            pendientes = self._volcar(pendientes)
+            fallos = fallos + 1 if pendientes else 0
+            if fin and pendientes:
+                if fallos > 3:
+                    print(f"Auditoría: {len(pendientes)} eventos sin escribir al cerrar:", self.ultimo_error)
+                    return
+                time.sleep(min(espera, 1))
+            elif fin:
+                return
+
+    def _volcar(self, pendientes):
+        # Una transacción por base y un append por archivo; devuelve los eventos que fallaron.
+        grupos = {}
+        for destino, dato in pendientes:
+            grupos.setdefault(destino, []).append(dato)
+        por_base = {}
+        for destino, filas in grupos.items():
+            if destino[0] == "sql":
+                por_base.setdefault(destino[2], []).append((destino, filas))
+        fallidos = []
+        for ruta, sentencias in por_base.items():
+            try:
+                with conexion_db(ruta) as conn:
+                    for (_, sentencia, _), filas in sentencias:
+                        conn.executemany(sentencia, filas)
+                self.escritos += sum(len(f) for _, f in sentencias); self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = e
+                print("Error al escribir auditoría (se reintentará):", e)
+                fallidos.extend((d, x) for d, filas in sentencias for x in filas)
+        for destino, lineas in grupos.items():
+            if destino[0] != "txt": continue
+            try:
+                with open(destino[1], "a", encoding="utf-8") as f:
+                    f.writelines(lineas)
+                self.escritos += len(lineas)
+            except Exception as e:
+                self.ultimo_error = e
+                print("Error al escribir auditoría (se reintentará):", e)
+                fallidos.extend((destino, x) for x in lineas)
+        return fallidos
+
+    def cerrar(self, timeout=5):
+        # Vuelca lo pendiente al salir; si el disco no responde en `timeout` segundos, se abandona.
+        if self._hilo is not None and self._hilo.is_alive():
+            self._cola.put(self._FIN)
+            self._hilo.join(timeout)
+
+cola_auditoria = ColaAuditoria()
+atexit.register(cola_auditoria.cerrar)
+
 def registrar_auditoria(accion, numero, cambios=""):
-    conn = sqlite3.connect(resource_path(DB_NAME))
-    cur = conn.cursor()
-    cur.execute("INSERT INTO auditoria (accion, numero_informe, usuario, fecha_hora, cambios) VALUES (?,?,?,?,?)",
-                (accion, numero, current_user, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cambios))
-    conn.commit()
-    conn.close()
+    cola_auditoria.sql("INSERT INTO auditoria (accion, numero_informe, usuario, fecha_hora, cambios) VALUES (?,?,?,?,?)",
+                       (accion, numero, current_user, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), cambios))
+
+def registrar_auditoria_lote(accion, numeros, cambios=""):
+    # Mismo instante para todo el lote; la cola lo vuelca en un solo executemany.
+    ahora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for numero in numeros:
+        cola_auditoria.sql("INSERT INTO auditoria (accion, numero_informe, usuario, fecha_hora, cambios) VALUES (?,?,?,?,?)",
+                           (accion, numero, current_user, ahora, cambios))
+
+def crear_registro_cambios(cur):
+    # Bitácora de cambios sobre iph alimentada por triggers; el backup incremental la consume.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS iph_cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            iph_id INTEGER NOT NULL,
+            operacion TEXT NOT NULL,
+            fecha TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS backup_checkpoint (
+            nombre TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL,
+            fecha TEXT
+        )
+    """)
+    for op, evento, fila in (("I","INSERT","new"), ("U","UPDATE","new"), ("D","DELETE","old")):
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS iph_cambios_{op.lower()} AFTER {evento} ON iph BEGIN "
+                    f"INSERT INTO iph_cambios (iph_id, operacion) VALUES ({fila}.id, '{op}'); END")
+
+def crear_bandeja_salida(cur):
+    # Bandeja de salida hacia la base central, escrita por triggers en la misma transacción que el cambio:
+    # una fila por numero_informe (varias ediciones se envían una vez); version crece con cada cambio
+    # para no descartar uno que llegue mientras se envía la versión anterior.
+    nueva = not _tabla_existe(cur, "iph_salida")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS iph_salida (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            numero_informe TEXT UNIQUE NOT NULL,
+            iph_id INTEGER,
+            operacion TEXT NOT NULL,            -- 'guardar' | 'borrar'
+            version INTEGER NOT NULL DEFAULT 1,
+            intentos INTEGER NOT NULL DEFAULT 0,
+            proximo_intento REAL NOT NULL DEFAULT 0,
+            ultimo_error TEXT
+        )
+    """)
+    encolar = ("INSERT INTO iph_salida (numero_informe, iph_id, operacion) VALUES ({num}, {iid}, '{op}') "
+               "ON CONFLICT(numero_informe) DO UPDATE SET iph_id = excluded.iph_id, operacion = excluded.operacion, "
+               "version = version + 1, intentos = 0, proximo_intento = 0, ultimo_error = NULL;")
+    guardar = encolar.format(num="new.numero_informe", iid="new.id", op="guardar")
+    borrar = encolar.format(num="old.numero_informe", iid="NULL", op="borrar")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS iph_salida_ai AFTER INSERT ON iph BEGIN {guardar} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS iph_salida_ad AFTER DELETE ON iph BEGIN {borrar} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS iph_salida_au_num AFTER UPDATE OF numero_informe ON iph "
+                f"WHEN old.numero_informe <> new.numero_informe BEGIN {borrar} END")
+    cur.execute(f"CREATE TRIGGER IF NOT EXISTS iph_salida_au AFTER UPDATE ON iph BEGIN {guardar} END")
+    if nueva:
+        # lo capturado antes de existir la bandeja también debe llegar a la central
+        cur.execute("INSERT INTO iph_salida (numero_informe, iph_id, operacion) "
+                    "SELECT numero_informe, id, 'guardar' FROM iph ORDER BY id")
+
+def _carpeta_backups(*sub):
+    ruta = resource_path(os.path.join(BACKUP_FOLDER, *sub))
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+def backup_incremental():
+    # Guarda sólo los registros cambiados desde el último checkpoint (el último estado de cada id, con su
+    # operación I/U/D) en backups/incremental/*.csv.gz. Los backups completos diarios son la base.
+    with conexion_db() as conn:
+        desde = (conn.execute("SELECT seq FROM backup_checkpoint WHERE nombre='incremental'").fetchone() or (0,))[0]
+        hasta = conn.execute("SELECT COALESCE(max(seq), 0) FROM iph_cambios").fetchone()[0]
+        columnas = columnas_iph(conn, "i.")
+    if hasta <= desde:
+        return None
+    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    archivo = os.path.join(_carpeta_backups("incremental"), f"iph_inc_{ts}_{desde+1}-{hasta}.csv.gz")
+    escribir_tabla(archivo,
+                   f"SELECT c.seq, c.operacion, c.iph_id, {columnas} FROM iph_cambios c LEFT JOIN iph i ON i.id = c.iph_id "
+                   "WHERE c.seq IN (SELECT max(seq) FROM iph_cambios WHERE seq > ? AND seq <= ? GROUP BY iph_id) "
+                   "ORDER BY c.seq", (desde, hasta))
+    with conexion_db() as conn:
+        conn.execute("INSERT OR REPLACE INTO backup_checkpoint (nombre, seq, fecha) VALUES ('incremental', ?, ?)",
+                     (hasta, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        conn.execute("DELETE FROM iph_cambios WHERE seq <= ?", (hasta,))
+    rotar_backups_incrementales()
+    return archivo
+
+def rotar_backups_incrementales(dias=None):
+    limite = time.time() - (dias or BACKUP_RETENCION_DIAS) * 86400
+    carpeta = _carpeta_backups("incremental")
+    for nombre in os.listdir(carpeta):
+        ruta = os.path.join(carpeta, nombre)
+        if nombre.startswith("iph_inc_") and os.path.getmtime(ruta) < limite:
+            os.remove(ruta)
+
+def solicitar_backup_incremental(espera=None):
+    programador_backups.solicitar_incremental(espera)
+
+class ProgramadorBackups:
+    """Único dueño de los backups de la base: el completo diario (backup online por páginas) y los incrementales."""
+    def __init__(self, intervalo=86400, paginas=1024, pausa=0.005, conservar=1):
+        self.intervalo = intervalo; self.paginas = paginas; self.pausa = pausa; self.conservar = conservar
+        self._lock = threading.Lock()
+        self._en_curso = None           # Event del backup completo que está corriendo
+        self._timer_inc = None          # incremental pendiente (agrupa ráfagas de altas)
+        self._hilo = None
+        self._despertar = threading.Event()
+        self.ultimo_backup = None       # datetime del último backup completo
+        self.ultima_duracion = None     # segundos
+        self.ultimo_tamano = None       # bytes
+        self.ultimo_archivo = None
+        self.ultimo_error = None
+        self.fallos = 0                 # backups completos fallidos seguidos (espera creciente)
+
+    def iniciar(self):
+        # Idempotente: todas las rutas de arranque antiguas terminan aquí y sólo existe un hilo.
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="backups", daemon=True)
+            self._hilo.start()
+
+    def _backups_completos(self):
+        carpeta = _carpeta_backups()
+        return sorted((os.path.join(carpeta, n) for n in os.listdir(carpeta) if n.startswith("backup_") and n.endswith(".db")),
+                      key=os.path.getmtime)
+
+    def _segundos_para_siguiente(self):
+        previos = self._backups_completos()
+        if not previos:
+            return 0
+        return max(0, os.path.getmtime(previos[-1]) + self.intervalo - time.time())
+
+    def _bucle(self):
+        while True:
+            espera = self._segundos_para_siguiente()
+            if espera <= 0:
+                if self.backup_completo() is None:
+                    # sin esperar se reintentaría en bucle (carpeta inaccesible, disco lleno…)
+                    self._despertar.wait(min(3600, 60 * 2 ** (self.fallos - 1)))
+                    self._despertar.clear()
+                continue
+            self._despertar.wait(min(espera, 3600))
+            self._despertar.clear()
+
+    def backup_completo(self):
+        # Si ya hay uno en curso no se lanza otro: se espera a ése y se devuelve su archivo.
+        with self._lock:
+            propio = self._en_curso is None
+            if propio:
+                self._en_curso = threading.Event()
+            evento = self._en_curso
+        if not propio:
+            evento.wait()
+            return self.ultimo_archivo
+        destino = None; copiado = False
+        try:
+            t0 = time.perf_counter()
+            destino = os.path.join(_carpeta_backups(), f"backup_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.db")
+            bck = sqlite3.connect(destino)
+            try:
+                with conexion_db() as conn:
+                    # por pasos, soltando el lock entre ellos para no frenar las escrituras de la GUI
+                    conn.backup(bck, pages=self.paginas, sleep=self.pausa)
+            finally:
+                bck.close()
+            copiado = True
+            self.ultimo_backup = datetime.datetime.now()
+            self.ultima_duracion = time.perf_counter() - t0
+            self.ultimo_tamano = os.path.getsize(destino)
+            self.ultimo_archivo = destino; self.ultimo_error = None; self.fallos = 0
+            # el historial vive en el almacén deduplicado; como .db suelto sólo queda el más reciente
+            almacen_backups.guardar(destino)
+            almacen_backups.podar()
+            for viejo in self._backups_completos()[:-self.conservar]:
+                os.remove(viejo)
+            return destino
+        except Exception as e:
+            self.ultimo_error = e; self.fallos += 1
+            print("Backup error:", e)
+            if destino and not copiado:
+                # un .db vacío o a medias pasaría por el último backup bueno
+                try: os.remove(destino)
+                except OSError: pass
+            return None
+        finally:
+            with self._lock:
+                self._en_curso = None
+            evento.set()
+
+    def solicitar(self):
+        # backup completo en segundo plano (se agrupa con el que esté en curso)
+        threading.Thread(target=self.backup_completo, daemon=True).start()
+
+    def solicitar_incremental(self, espera=None):
+        with self._lock:
+            if self._timer_inc is not None:
+                return
+            self._timer_inc = threading.Timer(BACKUP_INCREMENTAL_ESPERA if espera is None else espera, self._incremental)
+            self._timer_inc.daemon = True
+            self._timer_inc.start()
+
+    def _incremental(self):
+        with self._lock:
+            self._timer_inc = None
+        try:
+            backup_incremental()
+        except Exception as e:
+            print("Backup incremental error:", e)
+
+    def estado(self):
+        return {"ultimo_backup": self.ultimo_backup, "duracion_s": self.ultima_duracion,
+                "tamano_bytes": self.ultimo_tamano, "archivo": self.ultimo_archivo,
+                "en_curso": self._en_curso is not None, "error": self.ultimo_error}
+
+programador_backups = ProgramadorBackups()
+
+def describir_estado_backups():
+    est = programador_backups.estado()
+    if est["ultimo_backup"] is None:
+        return "Backup: sin backups en esta sesión" + (" (en curso)" if est["en_curso"] else "")
+    return (f"Último backup: {est['ultimo_backup']:%Y-%m-%d %H:%M:%S} · {est['duracion_s']:.1f} s · "
+            f"{est['tamano_bytes'] / 1048576:.1f} MB")
+
+class AlmacenBackups:
+    """Instantáneas de la base partidas en bloques direccionados por SHA-256; cada bloque se guarda una vez, comprimido.
+
+    objetos/ab/abcd…      bloque comprimido con zlib (el nombre es el hash del contenido sin comprimir)
+    instantaneas/X.json   manifiesto: tamaño, hash del archivo completo y lista ordenada de bloques
+    """
+    def __init__(self, raiz=None, tam_bloque=BACKUP_BLOQUE):
+        self._raiz = raiz; self.tam_bloque = tam_bloque
+        self._lock = threading.Lock()
+
+    @property
+    def raiz(self):
+        return self._raiz or _carpeta_backups("almacen")
+
+    def _ruta_objeto(self, h):
+        return os.path.join(self.raiz, "objetos", h[:2], h)
+
+    def _ruta_manifiesto(self, nombre):
+        return os.path.join(self.raiz, "instantaneas", nombre + ".json")
+
+    def guardar(self, ruta, nombre=None):
+        nombre = nombre or os.path.splitext(os.path.basename(ruta))[0]
+        total = hashlib.sha256(); bloques = []; nuevos = 0
+        with self._lock, open(ruta, "rb") as f:
+            while True:
+                datos = f.read(self.tam_bloque)
+                if not datos:
+                    break
+                total.update(datos)
+                h = hashlib.sha256(datos).hexdigest()
+                bloques.append(h)
+                destino = self._ruta_objeto(h)
+                if not os.path.exists(destino):
+                    os.makedirs(os.path.dirname(destino), exist_ok=True)
+                    tmp = destino + ".tmp"
+                    with open(tmp, "wb") as o:
+                        o.write(zlib.compress(datos, 6))
+                    os.replace(tmp, destino)
+                    nuevos += 1
+            manifiesto = {"nombre": nombre, "creado": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                          "tamano": f.tell(), "sha256": total.hexdigest(), "tam_bloque": self.tam_bloque,
+                          "bloques": bloques}
+            # el manifiesto es lo que hace visible la instantánea: temporal + fsync + rename, nunca a medias
+            ruta_man = self._ruta_manifiesto(nombre)
+            os.makedirs(os.path.dirname(ruta_man), exist_ok=True)
+            with open(ruta_man + ".tmp", "w", encoding="utf-8") as m:
+                json.dump(manifiesto, m)
+                m.flush(); os.fsync(m.fileno())
+            os.replace(ruta_man + ".tmp", ruta_man)
+        return nombre, nuevos
+
+    def _nombres(self):
+        carpeta = os.path.join(self.raiz, "instantaneas")
+        if not os.path.isdir(carpeta):
+            return []
+        return sorted(n[:-5] for n in os.listdir(carpeta) if n.endswith(".json"))
+
+    def instantaneas(self):
+        # Sólo las que tienen un manifiesto legible; las demás quedan en cuarentena.
+        return [nombre for nombre, _ in self._legibles()]
+
+    def _manifiesto(self, nombre):
+        with open(self._ruta_manifiesto(nombre), encoding="utf-8") as m:
+            man = json.load(m)
+        if not isinstance(man, dict) or not isinstance(man.get("bloques"), list) or "sha256" not in man:
+            raise ValueError("estructura inesperada")
+        return man
+
+    def _legibles(self, problemas=None):
+        # [(nombre, manifiesto)]. Un manifiesto ilegible (disco lleno, copia manual a medias) se aparta a
+        # instantaneas/cuarentena/ para que no bloquee la poda ni la verificación de las demás.
+        legibles = []
+        for nombre in self._nombres():
+            try:
+                legibles.append((nombre, self._manifiesto(nombre)))
+            except (OSError, ValueError) as e:
+                cuarentena = os.path.join(self.raiz, "instantaneas", "cuarentena")
+                try:
+                    os.makedirs(cuarentena, exist_ok=True)
+                    os.replace(self._ruta_manifiesto(nombre), os.path.join(cuarentena, nombre + ".json"))
+                except OSError:
+                    pass
+                print(f"Manifiesto de backup {nombre} ilegible, movido a cuarentena:", e)
+                if problemas is not None:
+                    problemas.append(f"{nombre}: manifiesto ilegible, movido a cuarentena ({e})")
+        return legibles
+
+    def restaurar(self, nombre, destino):
+        man = self._manifiesto(nombre)
+        total = hashlib.sha256()
+        with open(destino, "wb") as out:
+            for h in man["bloques"]:
+                with open(self._ruta_objeto(h), "rb") as o:
+                    datos = zlib.decompress(o.read())
+                total.update(datos); out.write(datos)
+        if total.hexdigest() != man["sha256"]:
+            raise ValueError(f"La instantánea {nombre} no coincide con su hash")
+        return destino
+
+    def verificar(self):
+        # Devuelve la lista de problemas (vacía si todo está bien); cada bloque se comprueba una sola vez.
+        problemas, buenos = [], set()
+        for nombre, man in self._legibles(problemas):
+            total = hashlib.sha256(); completo = True
+            for h in man["bloques"]:
+                try:
+                    with open(self._ruta_objeto(h), "rb") as o:
+                        datos = zlib.decompress(o.read())
+                except Exception as e:
+                    problemas.append(f"{nombre}: bloque {h[:12]} ilegible ({e})"); completo = False; break
+                if h not in buenos:
+                    if hashlib.sha256(datos).hexdigest() != h:
+                        problemas.append(f"{nombre}: bloque {h[:12]} corrupto"); completo = False; break
+                    buenos.add(h)
+                total.update(datos)
+            if completo and total.hexdigest() != man["sha256"]:
+                problemas.append(f"{nombre}: el archivo reconstruido no coincide con su hash")
+        return problemas
+
+    def podar(self, conservar=None):
+        # borra las instantáneas más antiguas y los bloques que ya no referencia ninguna
+        with self._lock:
+            legibles = self._legibles()
+            corte = max(0, len(legibles) - (conservar or BACKUP_INSTANTANEAS))
+            for nombre, _ in legibles[:corte]:
+                os.remove(self._ruta_manifiesto(nombre))
+            vivos = set()
+            for _, man in legibles[corte:]:
+                vivos.update(man["bloques"])
+            carpeta = os.path.join(self.raiz, "objetos")
+            for sub in (os.listdir(carpeta) if os.path.isdir(carpeta) else []):
+                for h in os.listdir(os.path.join(carpeta, sub)):
+                    if h not in vivos:
+                        os.remove(os.path.join(carpeta, sub, h))
+
+almacen_backups = AlmacenBackups()
+
+def compactar_en_almacen(conservar_db=1):
+    # Mueve los backup_*.db sueltos (salvo los más recientes) al almacén deduplicado.
+    previos = programador_backups._backups_completos()
+    movidos = 0
+    for ruta in previos[:max(0, len(previos) - conservar_db)]:
+        almacen_backups.guardar(ruta)
+        os.remove(ruta)
+        movidos += 1
+    return movidos
+
+def verificar_backups_cli():
+    problemas = almacen_backups.verificar()
+    print(f"{len(almacen_backups.instantaneas())} instantáneas verificadas")
+    for p in problemas:
+        print("ERROR:", p)
+    return 1 if problemas else 0
 
 def guardar_backup_excel():
-    try:
-        conn = sqlite3.connect(resource_path(DB_NAME))
-        df = pd.read_sql_query("SELECT * FROM iph", conn)
-        conn.close()
-        fname = resource_path(f"backup_IPH_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-        df.to_excel(fname, index=False)
-        # notify user
-        messagebox.showinfo("Backup", f"Backup guardado: {fname}")
-    except Exception as e:
-        print("Backup error:", e)
-        messagebox.showerror("Backup error", str(e))
+    fname = resource_path(f"backup_IPH_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+    def terminado(filas, error):
+        if error is not None:
+            print("Backup error:", error)
+            messagebox.showerror("Backup error", str(error))
+        elif filas is not None:
+            messagebox.showinfo("Backup", f"Backup guardado: {fname}")
+    # en un hilo, como exportar_excel: la tabla completa no congela la ventana
+    ejecutar_con_progreso(None, "Guardando backup Excel…",
+                          lambda progreso, cancelar: escribir_tabla(fname, progreso=progreso, cancelar=cancelar),
+                          terminado)
 
 def backup_automatico_diario():
-    # Simple thread that saves a daily backup at first run if enabled.
+    # El backup diario lo hace programador_backups (hace uno al arrancar si el último tiene más de un día).
     if not BACKUP_DAILY:
         return
+    programador_backups.iniciar()
+
+al_iniciar_sesion(backup_automatico_diario)
+
+# -----------------------
+# Sincronización con la base central
+# -----------------------
+class DestinoSQLite:
+    """Base central en un archivo SQLite (pruebas, o una carpeta compartida en la red local)."""
+    def __init__(self, ruta, tabla="iph_central"):
+        self.ruta = ruta; self.tabla = tabla
+
+    def enviar(self, guardar, borrar):
+        # guardar: [tuplas _IPH_CAMPOS_ALTA + (estacion, sincronizado_en)]; borrar: [numero_informe]
+        cols = _IPH_CAMPOS_ALTA + ("estacion", "sincronizado_en")
+        conn = sqlite3.connect(self.ruta, timeout=10)
+        try:
+            with conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {self.tabla} (numero_informe TEXT PRIMARY KEY, "
+                             + ", ".join(f"{c} TEXT" for c in cols[1:]) + ")")
+                conn.executemany(f"INSERT INTO {self.tabla} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+                                 f"ON CONFLICT(numero_informe) DO UPDATE SET "
+                                 + ", ".join(f"{c} = excluded.{c}" for c in cols[1:]), guardar)
+                conn.executemany(f"DELETE FROM {self.tabla} WHERE numero_informe = ?", [(n,) for n in borrar])
+        finally:
+            conn.close()
+
+class DestinoMySQL:
+    """Base central MySQL; mysql-connector-python sólo se importa al conectar."""
+    def __init__(self, tabla="iph_central", **conexion):
+        self.tabla = tabla; self.conexion = conexion
+
+    def conectar(self):
+        import mysql.connector
+        return mysql.connector.connect(connection_timeout=10, **self.conexion)
+
+    def enviar(self, guardar, borrar):
+        cols = _IPH_CAMPOS_ALTA + ("estacion", "sincronizado_en")
+        conn = self.conectar()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {self.tabla} (numero_informe VARCHAR(100) PRIMARY KEY, "
+                        + ", ".join(f"{c} TEXT" for c in cols[1:]) + ") CHARACTER SET utf8mb4")
+            if guardar:
+                cur.executemany(f"INSERT INTO {self.tabla} ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))}) "
+                                f"ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = VALUES({c})" for c in cols[1:]), guardar)
+            if borrar:
+                cur.executemany(f"DELETE FROM {self.tabla} WHERE numero_informe = %s", [(n,) for n in borrar])
+            conn.commit()
+        finally:
+            conn.close()
+
+class SincronizadorCentral:
+    """Vacía iph_salida hacia la base central en un hilo: lotes, reintentos con espera creciente, nunca bloquea la captura."""
+    def __init__(self, destino, estacion=None, lote=200, intervalo=15.0, espera_base=5.0, espera_max=600.0, ruta_db=None):
+        self.destino = destino
+        self.estacion = estacion or platform.node()
+        self.lote = lote; self.intervalo = intervalo
+        self.espera_base = espera_base; self.espera_max = espera_max
+        self.ruta_db = ruta_db
+        self._despertar = threading.Event(); self._fin = threading.Event()
+        self._hilo = None
+        self.enviados = 0; self.ultimo_error = None; self.ultima_sincronizacion = None
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._fin.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="sincronizacion", daemon=True)
+            self._hilo.start()
+
+    def avisar(self):
+        # hay cambios nuevos: no esperar al siguiente intervalo
+        self._despertar.set()
+
+    def pendientes(self):
+        with conexion_db(self.ruta_db) as conn:
+            return conn.execute("SELECT count(*) FROM iph_salida").fetchone()[0]
+
+    def _bucle(self):
+        while not self._fin.is_set():
+            try:
+                lleno = self.sincronizar_una_vez() >= self.lote
+            except Exception as e:  # la base local ocupada o dañada no debe matar el hilo
+                self.ultimo_error = e; lleno = False
+            if not lleno:
+                self._despertar.wait(self.intervalo)
+                self._despertar.clear()
+
+    def sincronizar_una_vez(self):
+        # Envía un lote listo para (re)intento. Devuelve cuántos registros se confirmaron.
+        ahora = time.time()
+        with conexion_db(self.ruta_db) as conn:
+            filas = conn.execute("SELECT s.seq, s.version, s.operacion, s.numero_informe, "
+                                 + ", ".join("i." + c for c in _IPH_CAMPOS_ALTA[1:])
+                                 + " FROM iph_salida s LEFT JOIN iph i ON i.id = s.iph_id "
+                                 "WHERE s.proximo_intento <= ? ORDER BY s.seq LIMIT ?", (ahora, self.lote)).fetchall()
+        if not filas:
+            return 0
+        sello = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        guardar = [tuple(f[3:]) + (self.estacion, sello) for f in filas if f[2] == "guardar" and f[4] is not None]
+        borrar = [f[3] for f in filas if f[2] == "borrar"]
+        enviadas = json.dumps([[f[0], f[1]] for f in filas])
+        try:
+            self.destino.enviar(guardar, borrar)
+        except Exception as e:
+            self.ultimo_error = e
+            with conexion_db(self.ruta_db) as conn:
+                for seq, version, intentos in conn.execute(
+                        "SELECT seq, version, intentos FROM iph_salida WHERE (seq, version) IN "
+                        "(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))", (enviadas,)).fetchall():
+                    # espera exponencial con variación aleatoria para que las estaciones no reintenten a la vez
+                    espera = min(self.espera_max, self.espera_base * 2 ** intentos) * random.uniform(0.5, 1.0)
+                    conn.execute("UPDATE iph_salida SET intentos = intentos + 1, proximo_intento = ?, ultimo_error = ? "
+                                 "WHERE seq = ? AND version = ?", (time.time() + espera, str(e)[:500], seq, version))
+            return 0
+        # confirmar sólo la versión enviada: un cambio posterior sigue en la bandeja
+        with conexion_db(self.ruta_db) as conn:
+            conn.execute("DELETE FROM iph_salida WHERE (seq, version) IN "
+                         "(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?))", (enviadas,))
+        self.enviados += len(filas); self.ultimo_error = None; self.ultima_sincronizacion = sello
+        return len(filas)
+
+    def cerrar(self, timeout=5):
+        self._fin.set(); self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+sincronizador_central = None
+
+def leer_config_central():
+    ruta = resource_path(CENTRAL_CONFIG)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+def crear_sincronizador(config, ruta_db=None):
+    # {"tipo": "sqlite", "ruta": ...} o {"tipo": "mysql", "host": ..., "database": ..., "user": ..., "password": ...};
+    # opcionales: "tabla", "estacion", "lote", "intervalo". "ruta" relativa se resuelve como CENTRAL_CONFIG.
+    # ruta_db fija la base local: el hilo sobrevive a la GUI y DB_NAME se redefine más abajo en el módulo.
+    config = dict(config)
+    tipo = config.pop("tipo", "mysql")
+    opciones = {k: config.pop(k) for k in ("estacion", "lote", "intervalo") if k in config}
+    if tipo == "sqlite":
+        destino = DestinoSQLite(resource_path(config["ruta"]), config.get("tabla", "iph_central"))
+    elif tipo == "mysql":
+        destino = DestinoMySQL(**config)
+    else:
+        raise ValueError(f"Destino central desconocido: {tipo}")
+    return SincronizadorCentral(destino, ruta_db=os.path.abspath(ruta_db or resource_path(DB_NAME)), **opciones)
+
+def iniciar_sincronizacion():
+    global sincronizador_central
+    if sincronizador_central is not None:
+        return
     try:
-        today = datetime.datetime.now().strftime("%Y%m%d")
-        target = resource_path(f"backup_IPH_{today}.xlsx")
-        if not os.path.exists(target):
-            guardar_backup_excel()
+        config = leer_config_central()
     except Exception as e:
-        print("Auto-backup error:", e)
+        print("Configuración central inválida:", e); return
+    if not config:
+        return  # sin destino: la bandeja se conserva hasta que se configure
+    sincronizador_central = crear_sincronizador(config, resource_path(DB_NAME))
+    sincronizador_central.iniciar()
+    atexit.register(sincronizador_central.cerrar)
+
+def avisar_sincronizacion():
+    if sincronizador_central is not None:
+        sincronizador_central.avisar()
+
+def sincronizar_cli():
+    # --sincronizar: vacía la bandeja una vez (p. ej. al recuperar conexión) y termina.
+    config = leer_config_central()
+    if not config:
+        print(f"No existe {CENTRAL_CONFIG}"); return 1
+    sinc = crear_sincronizador(config, resource_path(DB_NAME))
+    while sinc.sincronizar_una_vez():
+        pass
+    pendientes = sinc.pendientes()
+    print(f"Enviados: {sinc.enviados} · pendientes: {pendientes}" + (f" · error: {sinc.ultimo_error}" if sinc.ultimo_error else ""))
+    return 0 if not pendientes else 1
+
+al_iniciar_sesion(iniciar_sincronizacion)
 
 # -----------------------
 # Validaciones
@@ -155,98 +1578,618 @@ def validar_fecha(fecha):
 # -----------------------
 # Export / Import
 # -----------------------
+EXCEL_MAX_FILAS = 1_000_000  # por hoja (límite de Excel: 1 048 576)
+
+def escribir_tabla(path, sql=None, params=(), progreso=None, cancelar=None, tam_bloque=5000,
+                   ruta_db=None):
+    # Vuelca la consulta por bloques de cursor: .xlsx en modo write-only (una hoja nueva cada EXCEL_MAX_FILAS),
+    # .csv o .csv.gz. La memoria no depende del tamaño de la tabla. Sin sql se vuelca iph completa.
+    # progreso(hechas, total) se llama tras cada bloque; si cancelar (threading.Event) se activa se
+    # devuelve None. Se escribe en path + ".tmp" y sólo al terminar bien se renombra: un error o una
+    # cancelación nunca dejan un archivo truncado. Devuelve el número de filas escritas.
+    tmp = path + ".tmp"
+    wb = None; listo = False
+    try:
+        with conexion_db(ruta_db) as conn:
+            sql = sql or f"SELECT {columnas_iph(conn)} FROM iph ORDER BY id"
+            total = conn.execute(f"SELECT count(*) FROM ({sql})", params).fetchone()[0]
+            cur = conn.execute(sql, params)
+            columnas = [d[0] for d in cur.description]
+            hechas = 0
+            es_xlsx = path.lower().endswith(".xlsx")
+            if es_xlsx:
+                from openpyxl import Workbook
+                wb = Workbook(write_only=True)
+                ws = None
+                agregar = lambda fila: ws.append(fila)
+            else:
+                f = gzip.open(tmp, "wt", encoding="utf-8", newline="") if path.lower().endswith(".gz") \
+                    else open(tmp, "w", encoding="utf-8-sig", newline="")
+                w = csv.writer(f)
+                w.writerow(columnas)
+                agregar = w.writerow
+            try:
+                while True:
+                    if cancelar is not None and cancelar.is_set():
+                        break
+                    bloque = cur.fetchmany(tam_bloque)
+                    if not bloque:
+                        break
+                    for fila in bloque:
+                        if es_xlsx and hechas % EXCEL_MAX_FILAS == 0:
+                            ws = wb.create_sheet(f"iph_{hechas // EXCEL_MAX_FILAS + 1}" if hechas else "iph")
+                            ws.append(columnas)
+                        agregar(fila)
+                        hechas += 1
+                    if progreso: progreso(hechas, total)
+            finally:
+                cur.close()
+                if not es_xlsx: f.close()
+        if cancelar is not None and cancelar.is_set():
+            raise InterruptedError
+        if es_xlsx:
+            if ws is None: wb.create_sheet("iph").append(columnas)
+            wb.save(tmp)
+        os.replace(tmp, path); listo = True
+    except InterruptedError:
+        return None
+    finally:
+        if wb is not None and not listo:
+            for hoja in wb.worksheets:  # libera los temporales de openpyxl
+                try: hoja.close()
+                except Exception: pass
+        if os.path.exists(tmp):
+            try: os.remove(tmp)
+            except OSError: pass
+    return hechas
+
 def exportar_excel(path=None):
-    conn = sqlite3.connect(resource_path(DB_NAME))
-    df = pd.read_sql_query("SELECT * FROM iph", conn)
-    conn.close()
-    if df.empty:
+    with conexion_db() as conn:
+        hay = conn.execute("SELECT EXISTS(SELECT 1 FROM iph)").fetchone()[0]
+    if not hay:
         messagebox.showinfo("Exportar", "No hay registros para exportar.")
         return
     if not path:
-        path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel","*.xlsx")])
+        path = filedialog.asksaveasfilename(defaultextension=".xlsx",
+                                            filetypes=[("Excel","*.xlsx"), ("CSV","*.csv"), ("CSV comprimido","*.csv.gz")])
         if not path:
             return
-    df.to_excel(path, index=False)
-    messagebox.showinfo("Exportar", f"Exportado a {path}")
-    registrar_auditoria("EXPORTAR_EXCEL", "-")
+    def terminado(filas, error):
+        if error is not None:
+            messagebox.showerror("Exportar", f"Error exportando: {error}")
+        elif filas is None:
+            messagebox.showinfo("Exportar", "Exportación cancelada.")
+        else:
+            messagebox.showinfo("Exportar", f"Exportado a {path} ({filas} registros)")
+            registrar_auditoria("EXPORTAR_EXCEL", "-")
+    ejecutar_con_progreso(None, "Exportando registros…",
+                          lambda progreso, cancelar: escribir_tabla(path, progreso=progreso, cancelar=cancelar),
+                          terminado)
+
+def escribir_json_det_veh(path, progreso=None, cancelar=None, ruta_db=None, tam_bloque=2000):
+    # Escribe registro por registro el mismo JSON que json.dump(..., indent=2); los hijos se agregan en SQL.
+    # Como escribir_tabla: se escribe en path + ".tmp" y sólo se renombra si terminó bien.
+    tmp = path + ".tmp"
+    try:
+        with conexion_db(ruta_db) as conn:
+            total = conn.execute("SELECT count(*) FROM iph").fetchone()[0]
+            cur = conn.execute("""
+                SELECT i.id, i.numero_informe,
+                       (SELECT json_group_array(json_object('nombre', nombre, 'sexo', sexo))
+                          FROM (SELECT nombre, sexo FROM detenidos d WHERE d.iph_id = i.id ORDER BY d.id)),
+                       (SELECT json_group_array(json_object('tipo', tipo, 'marca', marca, 'placa', placa, 'serie', serie))
+                          FROM (SELECT tipo, marca, placa, serie FROM vehiculos v WHERE v.iph_id = i.id ORDER BY v.id))
+                FROM iph i ORDER BY i.id
+            """)
+            hechas = 0
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("[")
+                for bloque in iter(lambda: cur.fetchmany(tam_bloque), []):
+                    if cancelar is not None and cancelar.is_set():
+                        return None
+                    for iph_id, num, dets, vehs in bloque:
+                        rec = {"id": iph_id, "numero_informe": num, "detenidos": json.loads(dets), "vehiculos": json.loads(vehs)}
+                        f.write(("," if hechas else "") + "\n" + textwrap.indent(json.dumps(rec, ensure_ascii=False, indent=2), "  "))
+                        hechas += 1
+                    if progreso: progreso(hechas, total)
+                f.write("\n]" if hechas else "]")
+        if cancelar is not None and cancelar.is_set():
+            return None
+        os.replace(tmp, path)
+        return hechas
+    finally:
+        if os.path.exists(tmp):
+            try: os.remove(tmp)
+            except OSError: pass
 
 def exportar_json_det_veh(path=None):
-    conn = sqlite3.connect(resource_path(DB_NAME))
-    df = pd.read_sql_query("SELECT id, numero_informe, detenidos_json, vehiculos_json FROM iph", conn)
-    conn.close()
-    if df.empty:
+    with conexion_db() as conn:
+        hay = conn.execute("SELECT EXISTS(SELECT 1 FROM iph)").fetchone()[0]
+    if not hay:
         messagebox.showinfo("Exportar JSON", "No hay registros para exportar.")
         return
-    records = []
-    for _, r in df.iterrows():
-        records.append({
-            "id": int(r["id"]),
-            "numero_informe": r["numero_informe"],
-            "detenidos": json.loads(r["detenidos_json"]) if r["detenidos_json"] else [],
-            "vehiculos": json.loads(r["vehiculos_json"]) if r["vehiculos_json"] else []
-        })
     if not path:
         path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON","*.json")])
         if not path: return
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(records, f, ensure_ascii=False, indent=2)
-    messagebox.showinfo("Exportar JSON", f"Exportado a {path}")
-    registrar_auditoria("EXPORTAR_JSON", "-")
+    def terminado(filas, error):
+        if error is not None:
+            messagebox.showerror("Exportar JSON", f"Error exportando: {error}")
+        elif filas is not None:
+            messagebox.showinfo("Exportar JSON", f"Exportado a {path}")
+            registrar_auditoria("EXPORTAR_JSON", "-")
+    ejecutar_con_progreso(None, "Exportando JSON…",
+                          lambda progreso, cancelar: escribir_json_det_veh(path, progreso, cancelar), terminado)
+
+JSON_LOTE = 5000
+
+_TOKENS_JSON = re.compile(r'["{}\[\],]')
+_FIN_CADENA = re.compile(r'["\\]')
+_NUMERO_EN_TEXTO = re.compile(r'"numero_informe"\s*:\s*"?([^",}\s]*)')
+
+def _cortar_elemento(f, buf, ini, tam_buffer, max_registro):
+    # Camino lento: busca el fin del elemento que empieza en ini siguiendo cadenas y anidamiento, de modo
+    # que un elemento mal formado no desalinea a los siguientes. Devuelve (texto o None si excede
+    # max_registro, buf, posición tras el separador, ¿era el último?).
+    j, prof = ini, 0
+    en_cadena = demasiado = False
+    while True:
+        if j >= len(buf):
+            mas = f.read(tam_buffer)
+            if not mas:  # arreglo sin "]"
+                return (None if demasiado else buf[ini:]), buf, len(buf), True
+            if demasiado:
+                buf, j, ini = mas, j - len(buf), 0
+            else:
+                buf, j, ini = buf[ini:] + mas, j - ini, 0
+            continue
+        if en_cadena:
+            m = _FIN_CADENA.search(buf, j)
+            if not m: j = len(buf); continue
+            j = m.end() + (m.group() == "\\")  # tras "\" se salta el carácter escapado
+            en_cadena = m.group() == "\\"
+            continue
+        m = _TOKENS_JSON.search(buf, j)
+        if not m: j = len(buf); continue
+        c, j = m.group(), m.end()
+        if c == '"':
+            en_cadena = True
+        elif c in "{[":
+            prof += 1
+        elif c in "}]" and prof > 0:
+            prof -= 1
+        elif (c == "]" or c == ",") and prof == 0:
+            return (None if demasiado else buf[ini:m.start()]), buf, j, c == "]"
+        if not demasiado and j - ini > max_registro:
+            demasiado = True
+
+def _elementos_arreglo(f, buf, tam_buffer, max_registro):
+    # Un registro (o la excepción) por elemento de primer nivel. Camino rápido con raw_decode; si falla
+    # o el elemento queda cortado por el búfer, se delimita con _cortar_elemento y se decodifica aparte.
+    dec = json.JSONDecoder()
+    i = 0
+    while True:
+        while i < len(buf) and buf[i] in " \t\r\n":
+            i += 1
+        if i >= len(buf):
+            mas = f.read(tam_buffer)
+            if not mas: return
+            buf, i = buf[i:] + mas, 0
+            continue
+        if buf[i] == "]":
+            return
+        try:
+            obj, fin = dec.raw_decode(buf, i)
+            k = fin
+            while k < len(buf) and buf[k] in " \t\r\n":
+                k += 1
+            completo = k < len(buf) and buf[k] in ",]"
+        except json.JSONDecodeError:
+            completo = False
+        if completo:
+            yield obj
+            if buf[k] == "]": return
+            i = k + 1
+        else:
+            texto, buf, i, ultimo = _cortar_elemento(f, buf, i, tam_buffer, max_registro)
+            yield _decodificar_registro(texto, max_registro)
+            if ultimo: return
+        if i > tam_buffer:
+            buf, i = buf[i:], 0
+
+def _decodificar_registro(texto, max_registro):
+    # registro o la excepción; si se puede, la excepción lleva el numero_informe para el reporte
+    try:
+        if texto is None:
+            raise ValueError(f"registro mayor que {max_registro} caracteres")
+        return json.loads(texto)
+    except ValueError as e:
+        m = _NUMERO_EN_TEXTO.search(texto or "")
+        e.numero_informe = m.group(1) if m else None
+        return e
+
+def leer_registros_json(path, tam_buffer=1 << 20, max_registro=16 << 20):
+    # Lee un arreglo JSON o NDJSON sin cargar el archivo completo. Genera (n, registro, posicion_bytes) por
+    # elemento de primer nivel (o por línea en NDJSON); si no se puede decodificar, registro es la excepción.
+    with open(path, "r", encoding="utf-8-sig") as f:
+        inicio = f.read(tam_buffer)
+        resto = inicio.lstrip()
+        n = 0
+        if resto.startswith("["):
+            for rec in _elementos_arreglo(f, resto[1:], tam_buffer, max_registro):
+                n += 1
+                yield n, rec, f.buffer.tell()
+            return
+        f.seek(0)
+        for linea in f:
+            if linea.strip():
+                n += 1
+                yield n, _decodificar_registro(linea, max_registro), f.buffer.tell()
+
+def _guardar_rechazos(path, rechazos):
+    destino = path + ".rechazos.json"
+    if rechazos:
+        with open(destino, "w", encoding="utf-8") as f:
+            json.dump(rechazos, f, ensure_ascii=False, indent=1)
+        return destino
+    if os.path.exists(destino): os.remove(destino)
+    return None
+
+def importar_registros_json(path, progreso=None, cancelar=None, lote=JSON_LOTE):
+    # Actualiza detenidos/vehículos por numero_informe: cada lote va a una tabla temporal y se aplica con
+    # un UPDATE … FROM y dos INSERT … SELECT sobre json_each, en una transacción por lote.
+    # Si un numero_informe se repite en el archivo vale la primera aparición; las demás van a rechazos.
+    t0 = time.perf_counter()
+    total = os.path.getsize(path)
+    leidos = actualizados = 0
+    rechazos = []
+    with conexion_db() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS imp_json (numero_informe TEXT PRIMARY KEY, n INTEGER, "
+                     "detenidos TEXT, vehiculos TEXT)")
+        def aplicar(filas):
+            conn.execute("DELETE FROM imp_json")
+            conn.executemany("INSERT INTO imp_json VALUES (?,?,?,?)", filas)
+            for n, num in conn.execute("SELECT n, numero_informe FROM imp_json t WHERE NOT EXISTS "
+                                       "(SELECT 1 FROM iph i WHERE i.numero_informe = t.numero_informe)"):
+                rechazos.append({"registro": n, "numero_informe": num, "motivo": "numero_informe no existe"})
+            cur = conn.execute("UPDATE iph SET detenidos_json = t.detenidos, vehiculos_json = t.vehiculos "
+                               "FROM imp_json t WHERE iph.numero_informe = t.numero_informe")
+            hechos = cur.rowcount
+            for tabla in ("detenidos", "vehiculos"):
+                conn.execute(f"DELETE FROM {tabla} WHERE iph_id IN (SELECT i.id FROM iph i "
+                             f"JOIN imp_json t ON t.numero_informe = i.numero_informe)")
+            conn.execute("""
+                INSERT INTO detenidos (iph_id, nombre, sexo)
+                SELECT i.id, coalesce(json_extract(j.value,'$.nombre'),''), coalesce(json_extract(j.value,'$.sexo'),'')
+                FROM imp_json t JOIN iph i ON i.numero_informe = t.numero_informe, json_each(t.detenidos) j
+                WHERE j.type = 'object'
+            """)
+            conn.execute("""
+                INSERT INTO vehiculos (iph_id, tipo, marca, placa, serie)
+                SELECT i.id, coalesce(json_extract(j.value,'$.tipo'),''), coalesce(json_extract(j.value,'$.marca'),''),
+                       coalesce(json_extract(j.value,'$.placa'),''), coalesce(json_extract(j.value,'$.serie'),'')
+                FROM imp_json t JOIN iph i ON i.numero_informe = t.numero_informe, json_each(t.vehiculos) j
+                WHERE j.type = 'object'
+            """)
+            conn.commit()
+            return hechos
+        try:
+            filas, pos = [], 0
+            vistos = {}  # numero_informe -> registro: vale la primera aparición en todo el archivo
+            for n, rec, pos in leer_registros_json(path):
+                leidos = n
+                motivo = None
+                if isinstance(rec, Exception): motivo = f"JSON inválido en el elemento {n}: {rec}"
+                elif not isinstance(rec, dict): motivo = "no es un objeto"
+                elif not rec.get("numero_informe"): motivo = "sin numero_informe"
+                elif not isinstance(rec.get("detenidos", []), list) or not isinstance(rec.get("vehiculos", []), list):
+                    motivo = "detenidos/vehiculos deben ser listas"
+                elif str(rec["numero_informe"]) in vistos:
+                    motivo = f"duplicado en el archivo (se aplicó el registro {vistos[str(rec['numero_informe'])]})"
+                if motivo:
+                    num = rec.get("numero_informe") if isinstance(rec, dict) else getattr(rec, "numero_informe", None)
+                    rechazos.append({"registro": n, "numero_informe": num, "motivo": motivo})
+                    continue
+                vistos[str(rec["numero_informe"])] = n
+                filas.append((str(rec["numero_informe"]), n, json.dumps(rec.get("detenidos", []), ensure_ascii=False),
+                              json.dumps(rec.get("vehiculos", []), ensure_ascii=False)))
+                if len(filas) >= lote:
+                    actualizados += aplicar(filas); filas = []
+                    if progreso: progreso(pos, total)
+                    if cancelar is not None and cancelar.is_set(): break
+            else:
+                if filas: actualizados += aplicar(filas)
+                if progreso: progreso(total, total)
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.imp_json")
+            cache_registros.vaciar()  # detenidos/vehiculos_json cambiaron en bloque
+            if actualizados:
+                solicitar_backup_incremental()  # también con cancelación o error: los lotes previos ya están confirmados
+    segundos = time.perf_counter() - t0
+    return {"leidos": leidos, "actualizados": actualizados, "rechazos": rechazos, "segundos": segundos,
+            "por_segundo": leidos / segundos if segundos else 0.0, "archivo_rechazos": _guardar_rechazos(path, rechazos),
+            "cancelado": cancelar is not None and cancelar.is_set()}
 
 def importar_json_det_veh(path=None):
     if not path:
-        path = filedialog.askopenfilename(filetypes=[("JSON","*.json")])
+        path = filedialog.askopenfilename(filetypes=[("JSON","*.json"), ("NDJSON","*.ndjson *.jsonl")])
         if not path: return
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception as e:
-        messagebox.showerror("Importar JSON", f"Error leyendo JSON: {e}"); return
-    conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-    imported = 0
-    for rec in data:
-        num = rec.get("numero_informe")
-        if not num: continue
-        # Try to update iph by numero_informe
-        cur.execute("SELECT id FROM iph WHERE numero_informe=?", (num,))
-        if cur.fetchone():
-            cur.execute("UPDATE iph SET detenidos_json=?, vehiculos_json=? WHERE numero_informe=?",
-                        (json.dumps(rec.get("detenidos",[])), json.dumps(rec.get("vehiculos",[])), num))
-            imported += 1
-    conn.commit(); conn.close()
-    messagebox.showinfo("Importar JSON", f"Actualizados: {imported}")
-    registrar_auditoria("IMPORTAR_JSON", "-")
+    def terminado(res, error):
+        if error is not None:
+            messagebox.showerror("Importar JSON", f"Error leyendo JSON: {error}"); return
+        texto = (f"Actualizados: {res['actualizados']} de {res['leidos']} "
+                 f"({res['por_segundo']:.0f} registros/s)")
+        if res["cancelado"]: texto += "\nImportación cancelada (los lotes ya aplicados se conservan)."
+        if res["rechazos"]: texto += f"\nRechazados: {len(res['rechazos'])} → {res['archivo_rechazos']}"
+        messagebox.showinfo("Importar JSON", texto)
+        registrar_auditoria("IMPORTAR_JSON", "-", f"{res['actualizados']} actualizados, {len(res['rechazos'])} rechazados")
+    ejecutar_con_progreso(None, "Importando JSON…",
+                          lambda progreso, cancelar: importar_registros_json(path, progreso, cancelar),
+                          terminado)
 
 # -----------------------
 # PDF Report
 # -----------------------
+PDF_FILAS_POR_PAGINA = 46
+
+def escribir_pdf_tabla(path, titulo, columnas, bloques, total=0, anchos=None, progreso=None, cancelar=None):
+    # Dibuja una tabla paginada a partir de bloques de filas (p. ej. cursor.fetchmany). Cada página es una
+    # Table independiente de PDF_FILAS_POR_PAGINA filas con altura fija, así el costo de maquetado es lineal
+    # y en memoria sólo vive la página en curso. Devuelve las filas escritas o None si se canceló.
+    from reportlab.platypus import Table, TableStyle
+    from reportlab.lib import colors
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    ancho_pag, alto_pag = LETTER
+    margen = 36
+    util = ancho_pag - 2 * margen
+    anchos = anchos or [util / len(columnas)] * len(columnas)
+    estilo = TableStyle([
+        ("FONT", (0,0), (-1,0), "Helvetica-Bold", 8), ("FONT", (0,1), (-1,-1), "Helvetica", 7.5),
+        ("BACKGROUND", (0,0), (-1,0), colors.HexColor("#1F4E79")), ("TEXTCOLOR", (0,0), (-1,0), colors.white),
+        ("ROWBACKGROUNDS", (0,1), (-1,-1), [colors.white, colors.HexColor("#EEF3F8")]),
+        ("GRID", (0,0), (-1,-1), 0.25, colors.grey), ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+    ])
+    def recortar(valor, ancho):
+        ancho -= 6
+        texto = "" if valor is None else str(valor)[:int(ancho / 2)].replace("\n", " ")
+        if stringWidth(texto, "Helvetica", 7.5) <= ancho:
+            return texto
+        while texto and stringWidth(texto + "…", "Helvetica", 7.5) > ancho:
+            texto = texto[:int(len(texto) * 0.9) or len(texto) - 1]
+        return texto + "…"
+    c = canvas.Canvas(path, pagesize=LETTER)
+    pagina, hechas, num_pag = [], 0, 0
+    def volcar():
+        nonlocal num_pag
+        num_pag += 1
+        c.setFont("Helvetica-Bold", 12); c.drawString(margen, alto_pag - margen, titulo)
+        c.setFont("Helvetica", 8); c.drawRightString(ancho_pag - margen, margen / 2, f"Página {num_pag}")
+        t = Table([columnas] + pagina, colWidths=anchos, rowHeights=14)
+        t.setStyle(estilo)
+        _, alto = t.wrapOn(c, util, alto_pag)
+        t.drawOn(c, margen, alto_pag - margen - 12 - alto)
+        c.showPage()
+    for bloque in bloques:
+        if cancelar is not None and cancelar.is_set():
+            return None
+        for fila in bloque:
+            pagina.append([recortar(v, a) for v, a in zip(fila, anchos)])
+            if len(pagina) == PDF_FILAS_POR_PAGINA:
+                volcar(); pagina = []
+        hechas += len(bloque)
+        if progreso: progreso(hechas, total)
+    if pagina or not num_pag:
+        volcar()
+    c.save()
+    return hechas
+
+def escribir_pdf_resumen(path, progreso=None, cancelar=None, ruta_db=None):
+    with conexion_db(ruta_db) as conn:
+        total = conn.execute("SELECT count(*) FROM iph").fetchone()[0]
+        cur = conn.execute("SELECT numero_informe, fecha_hechos, denunciante, tipo_hecho FROM iph "
+                           "ORDER BY fecha_hechos DESC, id DESC")
+        return escribir_pdf_tabla(path, "Reporte IPH - Resumen",
+                                  ["No. informe", "Fecha", "Denunciante", "Tipo de hecho"],
+                                  iter(lambda: cur.fetchmany(2000), []), total,
+                                  anchos=[110, 90, 200, 140], progreso=progreso, cancelar=cancelar)
+
 def generar_pdf_resumen(path=None):
-    conn = sqlite3.connect(resource_path(DB_NAME))
-    df = pd.read_sql_query("SELECT * FROM iph ORDER BY fecha_hechos DESC", conn)
-    conn.close()
-    if df.empty:
+    with conexion_db() as conn:
+        hay = conn.execute("SELECT EXISTS(SELECT 1 FROM iph)").fetchone()[0]
+    if not hay:
         messagebox.showinfo("PDF", "No hay datos para generar PDF.")
         return
     if not path:
         path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF","*.pdf")])
         if not path:
             return
-    c = canvas.Canvas(path, pagesize=LETTER)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, 750, "Reporte IPH - Resumen")
-    c.setFont("Helvetica", 10)
-    y = 730
-    for i, r in df.iterrows():
-        line = f"{r['numero_informe']} | {r['fecha_hechos']} | {r['denunciante']} | {r['tipo_hecho']}"
-        c.drawString(40, y, line)
-        y -= 14
-        if y < 80:
-            c.showPage()
-            c.setFont("Helvetica", 10)
-            y = 750
-    c.save()
-    messagebox.showinfo("PDF", f"PDF generado: {path}")
-    registrar_auditoria("EXPORTAR_PDF", "-")
+    def terminado(filas, error):
+        if error is not None:
+            messagebox.showerror("PDF", f"Error generando PDF: {error}")
+        elif filas is None:
+            messagebox.showinfo("PDF", "Generación cancelada.")
+        else:
+            messagebox.showinfo("PDF", f"PDF generado: {path} ({filas} registros)")
+            registrar_auditoria("EXPORTAR_PDF", "-")
+    ejecutar_con_progreso(None, "Generando PDF…",
+                          lambda progreso, cancelar: escribir_pdf_resumen(path, progreso, cancelar), terminado)
+
+# -----------------------
+# Exportaciones en paralelo
+# -----------------------
+FORMATOS_EXPORTACION = {"xlsx": ".xlsx", "csv": ".csv", "json": ".json", "pdf": ".pdf"}
+_ESTADOS_FINALES = ("terminado", "cancelado", "error")
+
+def crear_instantanea_lectura():
+    # Copia consistente de la base (API de backup) para que los exportadores no compitan con la app.
+    fd, ruta = tempfile.mkstemp(prefix="iph_export_", suffix=".db")
+    os.close(fd)
+    with conexion_db() as conn, contextlib.closing(sqlite3.connect(ruta)) as destino:
+        conn.backup(destino, pages=1024)
+        destino.execute("PRAGMA journal_mode=WAL")
+    return ruta
+
+def _borrar_instantanea(ruta):
+    _cerrar_pool(ruta)
+    for sufijo in ("", "-wal", "-shm"):
+        try: os.remove(ruta + sufijo)
+        except OSError: pass
+
+def _exportar_formato(instantanea, formato, destino, cancelar, avances, trabajo_id):
+    # Corre en un proceso del pool.
+    t0 = time.perf_counter()
+    avances.put((trabajo_id, 0, 0))
+    progreso = lambda hechas, total: avances.put((trabajo_id, hechas, total))
+    try:
+        if formato == "json":
+            filas = escribir_json_det_veh(destino, progreso, cancelar, ruta_db=instantanea)
+        elif formato == "pdf":
+            filas = escribir_pdf_resumen(destino, progreso, cancelar, ruta_db=instantanea)
+        else:
+            filas = escribir_tabla(destino, progreso=progreso, cancelar=cancelar, ruta_db=instantanea)
+    finally:
+        _cerrar_pool(instantanea)
+    return filas, time.perf_counter() - t0
+
+class GestorExportaciones:
+    """Cola de exportaciones: una instantánea de la base alimenta varios formatos en un pool de procesos."""
+    def __init__(self, procesos=None):
+        self.procesos = procesos or min(4, os.cpu_count() or 1)
+        self.trabajos = {}
+        self._siguiente = 0
+        self._lock = threading.Lock()
+        self._ejecutor = self._manager = self._avances = None
+
+    def _iniciar(self):
+        with self._lock:
+            if self._ejecutor is None:
+                ctx = multiprocessing.get_context("spawn")
+                self._manager = ctx.Manager()
+                self._avances = self._manager.Queue()
+                self._ejecutor = concurrent.futures.ProcessPoolExecutor(self.procesos, mp_context=ctx)
+
+    def exportar(self, destinos):
+        # destinos: {formato: ruta}. Devuelve los ids de trabajo; la instantánea se toma en segundo plano.
+        ids = []
+        with self._lock:
+            for formato, ruta in destinos.items():
+                self._siguiente += 1
+                self.trabajos[self._siguiente] = {"id": self._siguiente, "formato": formato, "destino": ruta,
+                                                  "estado": "preparando", "hechas": 0, "total": 0, "filas": None,
+                                                  "creado": time.time(), "inicio": None, "fin": None, "error": None}
+                ids.append(self._siguiente)
+        threading.Thread(target=self._lanzar, args=(ids,), name="exportaciones", daemon=True).start()
+        return ids
+
+    def _terminar(self, trabajo, estado, error=None):
+        trabajo["estado"] = estado; trabajo["error"] = error
+        trabajo["fin"] = time.time()
+
+    def _lanzar(self, ids):
+        try:
+            self._iniciar()
+            instantanea = crear_instantanea_lectura()
+        except Exception as e:
+            for tid in ids:
+                self._terminar(self.trabajos[tid], "error", e)
+            return
+        pendientes = [len(ids)]
+        def hecho(tid, futuro):
+            t = self.trabajos[tid]
+            if futuro.cancelled():
+                self._terminar(t, "cancelado")
+            elif futuro.exception() is not None:
+                self._terminar(t, "error", futuro.exception())
+            else:
+                t["filas"], t["duracion"] = futuro.result()
+                self._terminar(t, "cancelado" if t["filas"] is None else "terminado")
+            with self._lock:
+                pendientes[0] -= 1
+                ultimo = pendientes[0] == 0
+            if ultimo:
+                _borrar_instantanea(instantanea)
+        for tid in ids:
+            t = self.trabajos[tid]
+            if t["estado"] == "cancelado":   # cancelado mientras se tomaba la instantánea
+                with self._lock: pendientes[0] -= 1
+                continue
+            t["cancelar"] = self._manager.Event()
+            t["estado"] = "en cola"
+            t["futuro"] = self._ejecutor.submit(_exportar_formato, instantanea, t["formato"], t["destino"],
+                                                t["cancelar"], self._avances, tid)
+            t["futuro"].add_done_callback(lambda f, tid=tid: hecho(tid, f))
+        if pendientes[0] == 0:
+            _borrar_instantanea(instantanea)
+
+    def cancelar(self, tid):
+        t = self.trabajos.get(tid)
+        if t is None or t["estado"] in _ESTADOS_FINALES:
+            return
+        if t["estado"] == "preparando":
+            self._terminar(t, "cancelado"); return
+        t["cancelar"].set()
+        t["futuro"].cancel()
+
+    def actualizar(self):
+        # Consume los avances que mandan los procesos; se llama desde el hilo de Tk.
+        while self._avances is not None:
+            try:
+                tid, hechas, total = self._avances.get_nowait()
+            except (queue.Empty, EOFError, OSError):
+                break
+            t = self.trabajos.get(tid)
+            if t is None: continue
+            t["hechas"], t["total"] = hechas, total
+            if t["inicio"] is None: t["inicio"] = time.time()
+            if t["estado"] not in _ESTADOS_FINALES: t["estado"] = "ejecutando"
+        return sorted(self.trabajos.values(), key=lambda t: t["id"])
+
+    def cerrar(self):
+        if self._ejecutor is not None:
+            self._ejecutor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._ejecutor = None
+
+gestor_exportaciones = GestorExportaciones()
+atexit.register(gestor_exportaciones.cerrar)
+
+def abrir_ventana_exportaciones(parent=None):
+    win = tk.Toplevel(parent); win.title("Exportaciones"); win.geometry("760x300")
+    cols = ("formato", "archivo", "estado", "avance", "tiempo")
+    tree = ttk.Treeview(win, columns=cols, show="headings", height=10)
+    for col, ancho in zip(cols, (70, 330, 90, 120, 80)):
+        tree.heading(col, text=col.capitalize()); tree.column(col, width=ancho, anchor="w")
+    tree.pack(fill="both", expand=True, padx=8, pady=(8,0))
+    botones = tk.Frame(win); botones.pack(fill="x", padx=8, pady=8)
+
+    def exportar_todo():
+        carpeta = filedialog.askdirectory(parent=win, title="Carpeta de destino")
+        if not carpeta: return
+        base = os.path.join(carpeta, "iph_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S"))
+        gestor_exportaciones.exportar({f: base + ext for f, ext in FORMATOS_EXPORTACION.items()})
+        registrar_auditoria("EXPORTAR_LOTE", "-", ", ".join(FORMATOS_EXPORTACION))
+
+    def cancelar():
+        for iid in tree.selection():
+            gestor_exportaciones.cancelar(int(iid))
+
+    tk.Button(botones, text="Exportar todo (xlsx, csv, json, pdf)…", command=exportar_todo).pack(side="left")
+    tk.Button(botones, text="Cancelar seleccionado", command=cancelar).pack(side="left", padx=8)
+
+    def refrescar():
+        if not win.winfo_exists(): return
+        ahora = time.time()
+        for t in gestor_exportaciones.actualizar():
+            avance = f"{t['hechas']}/{t['total']}" if t["total"] else ("-" if t["filas"] is None else str(t["filas"]))
+            desde = t["inicio"] or t["creado"]
+            tiempo = f"{(t['fin'] or ahora) - desde:.1f} s"
+            estado = t["estado"] if t["error"] is None else f"error: {t['error']}"
+            valores = (t["formato"], os.path.basename(t["destino"]), estado, avance, tiempo)
+            iid = str(t["id"])
+            if tree.exists(iid): tree.item(iid, values=valores)
+            else: tree.insert("", "end", iid=iid, values=valores)
+        win.after(300, refrescar)
+    refrescar()
+    return win
 
 # -----------------------
 # Mapa (abre en navegador con folium)
@@ -261,6 +2204,102 @@ def abrir_mapa_interactivo(initial_coords=(20.0, -100.0)):
     webbrowser.open("file://" + tmp.name)
     messagebox.showinfo("Mapa", "Mapa abierto en el navegador. Haz clic en el punto deseado y copia las coordenadas (lat, lon) al campo Coordenadas en la app.")
 
+# -----------------------
+# Mapa global agregado
+# -----------------------
+MAPA_NIVELES = ((0, 6, 1.0), (7, 9, 0.2), (10, 12, 0.04), (13, 18, 0.008))  # (zoom mín, zoom máx, celda en grados)
+MAPA_MAX_CELDAS = 3000     # por nivel; acota el tamaño del HTML sin importar cuántos registros haya
+
+def agrupar_rejilla(puntos, celda, limite=MAPA_MAX_CELDAS):
+    # Un renglón por celda ocupada: total, centroide y un registro de ejemplo; las celdas más densas primero.
+    claves = [np.floor(puntos["lat"] / celda).astype("int64"), np.floor(puntos["lon"] / celda).astype("int64")]
+    grupos = puntos.groupby(claves, sort=False).agg(total=("lat", "size"), lat=("lat", "mean"), lon=("lon", "mean"),
+                                                     etiqueta=("etiqueta", "first"))
+    return grupos.nlargest(limite, "total")
+
+def datos_mapa_iph(caja=None):
+    # caja=(lat_min, lat_max, lon_min, lon_max) limita por el índice espacial.
+    sql = ("SELECT i.lat, i.lon, coalesce(i.numero_informe, '') || ' · ' || coalesce(i.tipo_hecho, '') AS etiqueta "
+           "FROM iph i WHERE i.lat IS NOT NULL")
+    params = ()
+    if caja:
+        sql = sql.replace("FROM iph i WHERE", f"FROM iph_geo g JOIN iph i ON i.id = g.id WHERE {_CAJA_GEO} AND "
+                          f"{_CAJA_EXACTA} AND")
+        params = tuple(caja) * 2
+    with conexion_db() as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+def generar_mapa_global(puntos, archivo, titulo="Incidentes IPH"):
+    # Círculos agregados por rejilla, un grupo por nivel de zoom (clic = acercar), más una capa de calor opcional.
+    # Las celdas viajan como arreglos JSON compactos y los marcadores se crean en el navegador.
+    from folium.plugins import HeatMap
+    from branca.element import MacroElement, Template
+    m = folium.Map(location=[puntos["lat"].mean(), puntos["lon"].mean()], zoom_start=5, tiles="OpenStreetMap")
+    m.fit_bounds([[puntos["lat"].min(), puntos["lon"].min()], [puntos["lat"].max(), puntos["lon"].max()]])
+    niveles = []
+    for zmin, zmax, celda in MAPA_NIVELES:
+        g = agrupar_rejilla(puntos, celda)
+        celdas = [[round(a, 5), round(b, 5), int(n), html.escape(str(t))]
+                  for a, b, n, t in zip(g["lat"], g["lon"], g["total"], g["etiqueta"])]
+        niveles.append({"zmin": zmin, "zmax": zmax, "celdas": celdas})
+    calor = agrupar_rejilla(puntos, MAPA_NIVELES[-1][2], limite=MAPA_MAX_CELDAS * 5)
+    capa_calor = folium.FeatureGroup(name="Mapa de calor", show=False)
+    HeatMap(calor[["lat", "lon", "total"]].round(5).values.tolist(), radius=14, blur=18).add_to(capa_calor)
+    capa_calor.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    m.get_root().html.add_child(folium.Element(
+        '<div style="position:fixed;top:10px;left:60px;z-index:1000;background:rgba(255,255,255,.85);'
+        'padding:4px 10px;border-radius:4px;font:bold 15px sans-serif">'
+        f'{html.escape(titulo)} · {len(puntos)} registros</div>'))
+
+    class CapasPorZoom(MacroElement):
+        _template = Template("""
+            {% macro script(this, kwargs) %}
+            (function () {
+                var mapa = {{ this._parent.get_name() }};
+                var niveles = {{ this.datos }};
+                niveles.forEach(function (n, i) {
+                    n.capa = L.featureGroup();
+                    n.celdas.forEach(function (c) {
+                        var circulo = L.circleMarker([c[0], c[1]], {radius: Math.min(4 + 3 * Math.log2(c[2]), 28),
+                            weight: 1, color: "#8b0000", fillColor: "#d7301f", fillOpacity: 0.55})
+                            .bindTooltip(String(c[2]))
+                            .bindPopup("<b>" + c[2] + (c[2] == 1 ? " registro" : " registros") + "</b><br>" + c[3]
+                                       + (c[2] > 1 ? "<br><i>…</i>" : ""));
+                        if (i < niveles.length - 1)
+                            circulo.on("click", function (e) { mapa.setView(e.latlng, n.zmax + 1); });
+                        n.capa.addLayer(circulo);
+                    });
+                });
+                function actualizar() {
+                    var z = mapa.getZoom();
+                    niveles.forEach(function (n) {
+                        var ver = z >= n.zmin && z <= n.zmax;
+                        if (ver && !mapa.hasLayer(n.capa)) mapa.addLayer(n.capa);
+                        if (!ver && mapa.hasLayer(n.capa)) mapa.removeLayer(n.capa);
+                    });
+                }
+                mapa.on("zoomend", actualizar);
+                actualizar();
+            })();
+            {% endmacro %}""")
+
+        def __init__(self, niveles):
+            super().__init__()
+            self.datos = json.dumps(niveles, ensure_ascii=False).replace("</", "<\\/")
+    m.add_child(CapasPorZoom(niveles))
+    m.save(archivo)
+    return archivo
+
+def mapa_global(archivo, titulo="Incidentes IPH", caja=None):
+    # Devuelve el número de puntos graficados (0 si no hay coordenadas válidas).
+    puntos = datos_mapa_iph(caja)
+    if puntos.empty:
+        return 0
+    generar_mapa_global(puntos, archivo, titulo)
+    webbrowser.open("file://" + os.path.abspath(archivo))
+    return len(puntos)
+
 # -----------------------
 # GUI: ToolTip
 # -----------------------
@@ -279,18 +2318,299 @@ class ToolTip:
     def hide(self, e=None):
         if self.tip: self.tip.destroy(); self.tip = None
 
+# -----------------------
+# GUI: Filas dinámicas (detenidos / vehículos)
+# -----------------------
+class PoolFilas:
+    """Filas de campos reutilizables: cambiar la cantidad sólo muestra u oculta filas y conserva lo escrito."""
+    def __init__(self, frame, campos, estilo_etiqueta=None):
+        # campos: [(clave, etiqueta, fabrica(frame) -> widget)]; "{n}" en la etiqueta es el número de fila
+        self.frame = frame; self.campos = campos
+        self.estilo = estilo_etiqueta or {"bg": "#14202b", "fg": "white"}
+        self.filas = []       # [{"widgets": [...], "campos": {clave: widget}}]
+        self.visibles = 0
+
+    def _crear(self, i):
+        fila = {"widgets": [], "campos": {}}
+        for col, (clave, etiqueta, fabrica) in enumerate(self.campos):
+            lbl = tk.Label(self.frame, text=etiqueta.format(n=i+1), **self.estilo)
+            lbl.grid(row=i, column=2*col, padx=4, pady=2, sticky="e")
+            w = fabrica(self.frame); w.grid(row=i, column=2*col+1, padx=4, pady=2)
+            fila["widgets"] += [lbl, w]; fila["campos"][clave] = w
+        return fila
+
+    def mostrar(self, n):
+        # Sólo toca las filas que cambian de estado (O(|n - visibles|)).
+        n = max(0, n)
+        for i in range(self.visibles, n):
+            if i < len(self.filas):
+                for w in self.filas[i]["widgets"]: w.grid()
+            else:
+                self.filas.append(self._crear(i))
+        for i in range(n, self.visibles):
+            for w in self.filas[i]["widgets"]: w.grid_remove()
+        self.visibles = n
+
+    def valores(self):
+        return [{clave: w.get().strip() for clave, w in fila["campos"].items()} for fila in self.filas[:self.visibles]]
+
+    def limpiar(self):
+        for fila in self.filas:
+            for w in fila["campos"].values():
+                if isinstance(w, ttk.Combobox): w.set("")
+                else: w.delete(0, tk.END)
+
+def campos_detenido(prefijo="{n}."):
+    return [("nombre", prefijo + " Nombre:", lambda f: tk.Entry(f, width=25)),
+            ("sexo", "Sexo:", lambda f: ttk.Combobox(f, values=["Hombre","Mujer"], width=10))]
+
+def campos_vehiculo(prefijo="{n}."):
+    return [("tipo", prefijo + " Tipo:", lambda f: ttk.Combobox(f, values=["Terrestre","Acuático","Aéreo"], width=12)),
+            ("marca", "Marca:", lambda f: tk.Entry(f, width=15)),
+            ("placa", "Placa:", lambda f: tk.Entry(f, width=12)),
+            ("serie", "Serie:", lambda f: tk.Entry(f, width=18))]
+
+def enlazar_cantidad(var, pool):
+    # Spinbox -> PoolFilas; mientras el texto no es un número se ignora.
+    def cambiar(*args):
+        try:
+            pool.mostrar(var.get())
+        except tk.TclError:
+            pass
+    var.trace_add("write", cambiar)
+
+def detenidos_de(pool):
+    return [{"nombre": d["nombre"], "sexo": d["sexo"]} for d in pool.valores() if d["nombre"]]
+
+def vehiculos_de(pool):
+    return [v for v in pool.valores() if v["tipo"] or v["marca"] or v["placa"] or v["serie"]]
+
+# -----------------------
+# GUI: Tareas largas con progreso
+# -----------------------
+def ejecutar_con_progreso(parent, titulo, tarea, al_terminar):
+    # tarea(progreso, cancelar) corre en un hilo; progreso(hechas, total) puede llamarse desde ese hilo.
+    # al_terminar(resultado, error) se ejecuta en el hilo de Tk cuando la tarea acaba.
+    win = tk.Toplevel(parent); win.title(titulo); win.geometry("420x130"); win.resizable(False, False)
+    lbl = tk.Label(win, text=titulo); lbl.pack(pady=(12,4))
+    barra = ttk.Progressbar(win, length=380, mode="determinate"); barra.pack(padx=16)
+    cancelar = threading.Event()
+    btn = tk.Button(win, text="Cancelar", command=lambda: (cancelar.set(), btn.config(state="disabled")))
+    btn.pack(pady=8)
+    win.protocol("WM_DELETE_WINDOW", cancelar.set)
+    avances = queue.Queue(); fin = []
+    t0 = time.perf_counter()
+
+    def trabajo():
+        try:
+            fin.append((tarea(lambda h, t: avances.put((h, t)), cancelar), None))
+        except Exception as e:
+            fin.append((None, e))
+
+    def sondear():
+        ultimo = None
+        while not avances.empty():
+            ultimo = avances.get_nowait()
+        if ultimo:
+            hechas, total = ultimo
+            barra["maximum"] = max(total, 1); barra["value"] = hechas
+            lbl.config(text=f"{titulo} {hechas}/{total} · {time.perf_counter() - t0:.1f} s")
+        if fin:
+            win.destroy()
+            al_terminar(*fin[0])
+        else:
+            win.after(100, sondear)
+
+    threading.Thread(target=trabajo, daemon=True).start()
+    win.after(100, sondear)
+
+# -----------------------
+# GUI: Búsqueda en segundo plano
+# -----------------------
+class BuscadorDiferido:
+    """Agrupa las teclas, consulta en un hilo y sólo entrega al Treeview el resultado más reciente."""
+    def __init__(self, root, al_iniciar, al_terminar, espera_ms=250):
+        self.root = root; self.espera_ms = espera_ms
+        self.al_iniciar = al_iniciar; self.al_terminar = al_terminar
+        self._after = None; self._generacion = 0
+
+    def programar(self, consulta, inmediato=False):
+        # consulta(cancelado) -> resultado; corre fuera del hilo de Tk
+        if self._after:
+            self.root.after_cancel(self._after); self._after = None
+        if inmediato:
+            self._lanzar(consulta)
+        else:
+            self._after = self.root.after(self.espera_ms, self._lanzar, consulta)
+
+    def _lanzar(self, consulta):
+        self._after = None
+        self._generacion += 1
+        gen = self._generacion
+        cancelado = lambda: gen != self._generacion  # hay una búsqueda más nueva
+        self.al_iniciar()
+        t0 = time.perf_counter()
+        def trabajo():
+            try:
+                res, err = consulta(cancelado), None
+            except Exception as e:
+                res, err = None, e
+            self.root.after(0, self._entregar, gen, res, err, (time.perf_counter() - t0) * 1000)
+        threading.Thread(target=trabajo, daemon=True).start()
+
+    def _entregar(self, gen, res, err, ms):
+        if gen != self._generacion: return  # resultado obsoleto
+        self.al_terminar(res, err, ms)
+
+# -----------------------
+# GUI: Tabla paginada
+# -----------------------
+class TablaPaginada:
+    """Treeview con ventana deslizante: mantiene unas pocas páginas y pide más a SQLite al hacer scroll."""
+    # columnas de texto largo que sólo se muestran recortadas (el detalle completo va en ver_detalle)
+    COLUMNAS_RECORTADAS = {IPH_COLUMNAS_TABLA.index(c) for c in ("detenidos_json","vehiculos_json","observaciones")}
+    MAX_TEXTO = 60
+
+    def __init__(self, tree, vsb, tam_pagina=200, max_paginas=3):
+        self.tree = tree; self.vsb = vsb
+        self.tam_pagina = tam_pagina; self.max_filas = tam_pagina * max_paginas
+        self.fuente = None; self.claves = {}
+        self.hay_mas_arriba = False; self.hay_mas_abajo = False; self.cargando = False
+        tree.configure(yscrollcommand=self._on_scroll)
+
+    def _valores(self, r):
+        vals = []
+        for i, v in enumerate(r[:len(IPH_COLUMNAS_TABLA)]):
+            v = "" if v is None else v
+            if i in self.COLUMNAS_RECORTADAS and len(str(v)) > self.MAX_TEXTO:
+                v = str(v)[:self.MAX_TEXTO] + "…"
+            vals.append(v)
+        return tuple(vals)
+
+    def _insertar(self, filas, pos):
+        for r in filas:
+            iid = str(r[0])
+            if self.tree.exists(iid): continue
+            self.claves[iid] = (r[2], r[0])  # (fecha_hechos, id)
+            self.tree.insert("", pos, iid=iid, values=self._valores(r))
+            if pos != tk.END: pos += 1
+
+    def _quitar(self, items):
+        for iid in items:
+            self.claves.pop(iid, None)
+        if items: self.tree.delete(*items)
+
+    def quitar_filas(self, ids):
+        self._quitar([iid for iid in map(str, ids) if self.tree.exists(iid)])
+
+    def actualizar_filas(self, filas):
+        # Reescribe en su sitio las filas visibles cuya clave de orden no cambió (conserva selección y scroll);
+        # devuelve las demás para colocar().
+        resto = []
+        for r in filas:
+            iid = str(r[0])
+            if self.tree.exists(iid) and self.claves[iid][0] == r[2]:
+                self.tree.item(iid, values=self._valores(r))
+            else:
+                resto.append(r)
+        return resto
+
+    def colocar(self, r):
+        # Inserta o mueve una fila a su lugar (fecha_hechos, id) DESC dentro de la ventana cargada.
+        # Si cae fuera (en páginas que aún no están en el Treeview) no se muestra: llegará al hacer scroll.
+        iid = str(r[0]); clave = (r[2] or "", r[0])
+        if self.tree.exists(iid):
+            self._quitar([iid])
+        items = self.tree.get_children()
+        pos = next((n for n, i in enumerate(items) if (self.claves[i][0] or "", self.claves[i][1]) < clave), len(items))
+        if (pos == len(items) and self.hay_mas_abajo) or (pos == 0 and self.hay_mas_arriba):
+            return False
+        self._insertar([r], pos if pos < len(items) else tk.END)
+        if len(items) + 1 > self.max_filas:
+            self._quitar([self.tree.get_children()[-1]]); self.hay_mas_abajo = True
+        return True
+
+    def recargar(self, fuente, filas=None):
+        # fuente(despues=None, antes=None, limite=None) -> filas en orden (fecha_hechos, id) DESC
+        self.fuente = fuente
+        self._quitar(self.tree.get_children())
+        if filas is None:
+            filas = fuente(limite=self.tam_pagina)
+        self._insertar(filas, tk.END)
+        self.hay_mas_arriba = False
+        self.hay_mas_abajo = len(filas) >= self.tam_pagina
+        self.tree.yview_moveto(0)
+
+    def _on_scroll(self, first, last):
+        self.vsb.set(first, last)
+        if self.cargando or not self.fuente: return
+        if float(last) > 0.95 and self.hay_mas_abajo:
+            self.cargando = True; self.tree.after_idle(self._cargar_abajo)
+        elif float(first) < 0.05 and self.hay_mas_arriba:
+            self.cargando = True; self.tree.after_idle(self._cargar_arriba)
+
+    def _fila_superior(self, items):
+        return items[min(int(self.tree.yview()[0] * len(items)), len(items) - 1)]
+
+    def _mantener_ancla(self, ancla):
+        # deja la fila que estaba arriba en la misma posición visible tras añadir/recortar páginas
+        items = self.tree.get_children()
+        if ancla and self.tree.exists(ancla) and items:
+            self.tree.yview_moveto(self.tree.index(ancla) / len(items))
+
+    def _cargar_abajo(self):
+        try:
+            items = self.tree.get_children()
+            if not items: return
+            ancla = self._fila_superior(items)
+            filas = self.fuente(despues=self.claves[items[-1]], limite=self.tam_pagina)
+            self.hay_mas_abajo = len(filas) >= self.tam_pagina
+            self._insertar(filas, tk.END)
+            items = self.tree.get_children()
+            if len(items) > self.max_filas:
+                self._quitar(items[:len(items) - self.max_filas])
+                self.hay_mas_arriba = True
+            self._mantener_ancla(ancla)
+        finally:
+            self.cargando = False
+
+    def _cargar_arriba(self):
+        try:
+            items = self.tree.get_children()
+            if not items: return
+            ancla = self._fila_superior(items)
+            filas = self.fuente(antes=self.claves[items[0]], limite=self.tam_pagina)
+            self.hay_mas_arriba = len(filas) >= self.tam_pagina
+            self._insertar(filas, 0)
+            items = self.tree.get_children()
+            if len(items) > self.max_filas:
+                self._quitar(items[self.max_filas:])
+                self.hay_mas_abajo = True
+            self._mantener_ancla(ancla)
+        finally:
+            self.cargando = False
+
 # -----------------------
 # GUI principal
 # -----------------------
 def abrir_dashboard():
     global current_user
     conectar_db()
-    backup_automatico_diario()
 
     root = tk.Tk()
     root.title("Software Profesional IPH")
     root.geometry("1400x800")
     root.configure(bg="#0b1620")
+    # los servicios pueden mostrar diálogos: se arrancan cuando ya existe la ventana principal
+    iniciar_servicios_sesion()
+
+    # bottom status bar (usuario a la izquierda, estado de la búsqueda a la derecha)
+    barra_estado = tk.Frame(root, bg="#0b1620")
+    barra_estado.pack(side="bottom", fill="x")
+    status = tk.Label(barra_estado, text="Usuario: "+(current_user or "N/A"), bg="#0b1620", fg="white", anchor="w")
+    status.pack(side="left", fill="x")
+    status_busqueda = tk.Label(barra_estado, text="", bg="#0b1620", fg="#9fb3c8", anchor="e")
+    status_busqueda.pack(side="right", padx=8)
 
     # Sidebar
     SIDEBAR_W = 260
@@ -308,9 +2628,9 @@ def abrir_dashboard():
     scroll_y.pack(side="right", fill="y")
 
     # load icons
-    icons = {}
-    for name in ("add","update","delete","clear","excel","pdf","clean","auditoria","user","logout","map"):
-        icons[name] = cargar_icono(f"{name}.png", (48,48))
+    nombres = ("add","update","delete","clear","excel","pdf","clean","auditoria","user","logout","map")
+    atlas = cargar_iconos([f"{name}.png" for name in nombres], (48,48))
+    icons = {name: atlas[f"{name}.png"] for name in nombres}
 
     def sidebar_button(text, icon, cmd, tip_text=None):
         b = tk.Button(frame_sb, text="  "+text, image=icon, compound="left", anchor="w",
@@ -327,6 +2647,8 @@ def abrir_dashboard():
     sidebar_button("Exportar JSON (det/veh)", icons.get("update"), lambda: exportar_json_det_veh(), "Exportar JSON con detenidos/vehículos")
     sidebar_button("Exportar Excel", icons.get("excel"), lambda: exportar_excel(None), "Exportar tabla completa a Excel")
     sidebar_button("Exportar PDF", icons.get("pdf"), lambda: generar_pdf_resumen(), "Exportar reporte PDF")
+    sidebar_button("Exportaciones", icons.get("excel"), lambda: abrir_ventana_exportaciones(root),
+                   "Exportar a varios formatos en paralelo y ver el estado de cada trabajo")
     sidebar_button("Mapa (abrir)", icons.get("map"), lambda: abrir_mapa_interactivo(), "Abrir mapa interactivo en navegador")
     sidebar_button("Generar DB limpia", icons.get("clean"), lambda: generar_db_limpia(), "Borrar registros y generar backup")
     sidebar_button("Generar Auditoría", icons.get("auditoria"), lambda: generar_auditoria(), "Exportar registros de auditoría")
@@ -379,18 +2701,8 @@ def abrir_dashboard():
     frame_dets = tk.Frame(form, bg="#14202b")
     frame_dets.grid(row=5, column=0, columnspan=6, sticky="w", padx=6)
 
-    det_widgets = []  # list of dicts {nombre:Entry, sexo:Combobox}
-    def actualizar_detenidos(*args):
-        for w in frame_dets.winfo_children(): w.destroy()
-        det_widgets.clear()
-        n = var_num_det.get()
-        for i in range(n):
-            tk.Label(frame_dets, text=f"{i+1}. Nombre:", bg="#14202b", fg="white").grid(row=i, column=0, padx=4, pady=2, sticky="e")
-            e_nom = tk.Entry(frame_dets, width=25); e_nom.grid(row=i, column=1, padx=4, pady=2)
-            tk.Label(frame_dets, text="Sexo:", bg="#14202b", fg="white").grid(row=i, column=2, padx=4, pady=2, sticky="e")
-            cb_sex = ttk.Combobox(frame_dets, values=["Hombre","Mujer"], width=10); cb_sex.grid(row=i, column=3, padx=4, pady=2)
-            det_widgets.append({"nombre": e_nom, "sexo": cb_sex})
-    var_num_det.trace_add("write", lambda *args: actualizar_detenidos())
+    pool_det = PoolFilas(frame_dets, campos_detenido())
+    enlazar_cantidad(var_num_det, pool_det)
 
     # Row 6 - Vehículos dynamic
     tk.Label(form, text="Vehículos (0-10)", bg="#14202b", fg="white").grid(row=6, column=0, sticky="e", padx=6, pady=8)
@@ -399,22 +2711,8 @@ def abrir_dashboard():
     spin_veh.grid(row=6, column=1, sticky="w", padx=6, pady=8)
     frame_vehs = tk.Frame(form, bg="#14202b")
     frame_vehs.grid(row=7, column=0, columnspan=6, sticky="w", padx=6)
-    veh_widgets = []
-    def actualizar_vehiculos(*args):
-        for w in frame_vehs.winfo_children(): w.destroy()
-        veh_widgets.clear()
-        n = var_num_veh.get()
-        for i in range(n):
-            tk.Label(frame_vehs, text=f"{i+1}. Tipo:", bg="#14202b", fg="white").grid(row=i, column=0, padx=4, pady=2, sticky="e")
-            cb_tipo = ttk.Combobox(frame_vehs, values=["Terrestre","Acuático","Aéreo"], width=12); cb_tipo.grid(row=i, column=1, padx=4, pady=2)
-            tk.Label(frame_vehs, text="Marca:", bg="#14202b", fg="white").grid(row=i, column=2, padx=4, pady=2, sticky="e")
-            e_marca = tk.Entry(frame_vehs, width=15); e_marca.grid(row=i, column=3, padx=4, pady=2)
-            tk.Label(frame_vehs, text="Placa:", bg="#14202b", fg="white").grid(row=i, column=4, padx=4, pady=2, sticky="e")
-            e_placa = tk.Entry(frame_vehs, width=12); e_placa.grid(row=i, column=5, padx=4, pady=2)
-            tk.Label(frame_vehs, text="Serie:", bg="#14202b", fg="white").grid(row=i, column=6, padx=4, pady=2, sticky="e")
-            e_serie = tk.Entry(frame_vehs, width=18); e_serie.grid(row=i, column=7, padx=4, pady=2)
-            veh_widgets.append({"tipo": cb_tipo, "marca": e_marca, "placa": e_placa, "serie": e_serie})
-    var_num_veh.trace_add("write", lambda *args: actualizar_vehiculos())
+    pool_veh = PoolFilas(frame_vehs, campos_vehiculo())
+    enlazar_cantidad(var_num_veh, pool_veh)
 
     # Row 8 - Observaciones & botones
     tk.Label(form, text="Observaciones", bg="#14202b", fg="white").grid(row=8, column=0, sticky="ne", padx=6, pady=8)
@@ -433,28 +2731,9 @@ def abrir_dashboard():
         entry_vict.delete(0, tk.END)
         entry_coords.delete(0, tk.END)
         var_num_det.set(0); var_num_veh.set(0)
+        pool_det.limpiar(); pool_veh.limpiar()
         txt_obs.delete("1.0", tk.END)
 
-    def recoger_detenidos():
-        res = []
-        for w in det_widgets:
-            nombre = w["nombre"].get().strip()
-            sexo = w["sexo"].get().strip()
-            if nombre:
-                res.append({"nombre": nombre, "sexo": sexo})
-        return res
-
-    def recoger_vehiculos():
-        res = []
-        for w in veh_widgets:
-            tipo = w["tipo"].get().strip()
-            marca = w["marca"].get().strip()
-            placa = w["placa"].get().strip()
-            serie = w["serie"].get().strip()
-            if tipo or marca or placa or serie:
-                res.append({"tipo": tipo, "marca": marca, "placa": placa, "serie": serie})
-        return res
-
     def accion_guardar():
         datos = {
             "numero_informe": entry_num.get().strip(),
@@ -467,14 +2746,13 @@ def abrir_dashboard():
             "puesta_a_disposicion": entry_puesta.get().strip(),
             "victima": entry_vict.get().strip(),
             "coordenadas": entry_coords.get().strip(),
-            "detenidos": recoger_detenidos(),
-            "vehiculos": recoger_vehiculos(),
+            "detenidos": detenidos_de(pool_det),
+            "vehiculos": vehiculos_de(pool_veh),
             "observaciones": txt_obs.get("1.0", tk.END).strip(),
             "estado_procesal": "En trámite"
         }
-        insertar_iph(datos)
-        filtrar()  # refresh table
-        limpiar_formulario()
+        if insertar_iph(datos):  # la tabla se actualiza por al_cambiar_iph
+            limpiar_formulario()
 
     btn_save = tk.Button(form, text="Guardar IPH", bg="#1abc9c", fg="white", command=accion_guardar)
     btn_save.grid(row=9, column=1, padx=6, pady=10, sticky="w")
@@ -496,7 +2774,13 @@ def abrir_dashboard():
     tk.Label(filter_frame, text="Filtro Tipo:", bg="#14202b", fg="white").pack(side="left", padx=6)
     cb_filter_tipo = ttk.Combobox(filter_frame, values=["", "IP (General)","Robo","Homicidio","Fraude","Lesiones","Otro"], width=18)
     cb_filter_tipo.pack(side="left", padx=6)
-    btn_clear_filters = tk.Button(filter_frame, text="Limpiar filtros", command=lambda: (e_search.delete(0,tk.END), cb_filter_tipo.set(''), filtrar()))
+    tk.Label(filter_frame, text="Cerca de (lat, lon):", bg="#14202b", fg="white").pack(side="left", padx=6)
+    e_cerca = tk.Entry(filter_frame, width=20); e_cerca.pack(side="left", padx=2)
+    cb_radio = ttk.Combobox(filter_frame, values=["0.5", "1", "2", "5", "10", "25"], width=4)
+    cb_radio.set("2"); cb_radio.pack(side="left", padx=2)
+    tk.Label(filter_frame, text="km", bg="#14202b", fg="white").pack(side="left")
+    ToolTip(e_cerca, "Sólo IPH dentro del radio indicado alrededor de estas coordenadas")
+    btn_clear_filters = tk.Button(filter_frame, text="Limpiar filtros", command=lambda: (e_search.delete(0,tk.END), cb_filter_tipo.set(''), e_cerca.delete(0,tk.END), filtrar()))
     btn_clear_filters.pack(side="left", padx=6)
 
     # Table
@@ -509,65 +2793,100 @@ def abrir_dashboard():
         tree.column(c, anchor="w", width=110)
     tree.pack(side="left", fill="both", expand=True)
     vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview); vsb.pack(side="right", fill="y")
-    tree.configure(yscrollcommand=vsb.set)
+    tabla = TablaPaginada(tree, vsb)
+
+    def busqueda_iniciada():
+        status_busqueda.config(text="Buscando…")
+
+    def busqueda_terminada(res, err, ms):
+        if err is not None:
+            status_busqueda.config(text=f"Error en búsqueda: {err}"); return
+        fuente, filas = res
+        tabla.recargar(fuente, filas)
+        mas = "+" if len(filas) >= tabla.tam_pagina else ""
+        status_busqueda.config(text=f"{len(filas)}{mas} resultados · {ms:.0f} ms")
 
-    # Populate table
+    buscador = BuscadorDiferido(root, busqueda_iniciada, busqueda_terminada)
+
+    # Populate table (sólo la primera página; el resto se pide al hacer scroll)
+    filtro = {"term": "", "tipo": "", "cerca": None}   # filtro de la última búsqueda lanzada
     def filtrar(event=None):
-        term = e_search.get().strip().lower()
-        tipo_sel = cb_filter_tipo.get().strip().lower()
-        for it in tree.get_children(): tree.delete(it)
-        conn = sqlite3.connect(resource_path(DB_NAME))
-        df = pd.read_sql_query("SELECT * FROM iph ORDER BY fecha_hechos DESC", conn)
-        conn.close()
-        if df.empty: return
-        for _, r in df.iterrows():
-            # filter
-            match = True
-            if term:
-                hay = False
-                for f in ("numero_informe","denunciante","tipo_hecho","lugar","victima"):
-                    if term in str(r.get(f,"")).lower():
-                        hay = True; break
-                # also search in detainees names & vehicle plates
-                try:
-                    dets = json.loads(r.get("detenidos_json") or "[]")
-                    for d in dets:
-                        if term in str(d.get("nombre","")).lower(): hay = True; break
-                except Exception:
-                    pass
-                if not hay: match = False
-            if tipo_sel:
-                if tipo_sel not in str(r.get("tipo_hecho","")).lower(): match = False
-            if match:
-                deten_str = r.get("detenidos_json") or ""
-                veh_str = r.get("vehiculos_json") or ""
-                creado = r.get("creado_en") or ""
-                tree.insert("", tk.END, values=(
-                    r["id"], r["numero_informe"], r["fecha_hechos"], r["denunciante"], r["tipo_hecho"],
-                    r.get("tipo_delito",""), r.get("lugar",""), r.get("autoridad",""),
-                    deten_str, veh_str, r.get("victima",""), r.get("coordenadas",""),
-                    r.get("estado_procesal",""), r.get("observaciones",""), creado
-                ))
+        term, tipo = e_search.get(), cb_filter_tipo.get()
+        punto = coordenadas_de_texto(e_cerca.get())
+        try:
+            cerca = punto + (float(cb_radio.get()),) if punto else None
+        except ValueError:
+            cerca = None
+        filtro.update(term=term, tipo=tipo, cerca=cerca)
+        # cada página leída alimenta la cache de registros (ver_detalle no vuelve a la base)
+        fuente = lambda despues=None, antes=None, limite=None: cache_registros.guardar(
+            buscar_iph(term, tipo, limite, despues, antes, cerca=cerca))
+        def consulta(cancelado):
+            return fuente, cache_registros.guardar(buscar_iph(term, tipo, tabla.tam_pagina, cancelado=cancelado, cerca=cerca))
+        # las teclas se agrupan; filtrar() sin evento (guardar, limpiar filtros) se lanza ya
+        buscador.programar(consulta, inmediato=event is None)
     e_search.bind("<KeyRelease>", filtrar)
     cb_filter_tipo.bind("<<ComboboxSelected>>", lambda e: filtrar())
+    e_cerca.bind("<KeyRelease>", filtrar)
+    cb_radio.bind("<<ComboboxSelected>>", lambda e: filtrar())
+    cb_radio.bind("<KeyRelease>", filtrar)
     filtrar()
 
+    # Altas, bajas y cambios de estado llegan fila a fila: no se vuelve a leer la tabla completa.
+    def aplicar_cambio(operacion, filas):
+        if operacion == "D":
+            tabla.quitar_filas(filas); return
+        if expresion_fts(filtro["term"]) or filtro["tipo"].strip() or filtro["cerca"]:
+            # una consulta por clave primaria decide qué filas siguen dentro del filtro activo
+            dentro = {r[0] for r in buscar_iph(filtro["term"], filtro["tipo"], cerca=filtro["cerca"],
+                                               ids=[r[0] for r in filas])}
+        else:
+            dentro = {r[0] for r in filas}
+        tabla.quitar_filas(r[0] for r in filas if r[0] not in dentro)
+        filas = [r for r in filas if r[0] in dentro]
+        if operacion == "U":
+            filas = tabla.actualizar_filas(filas)
+        for r in filas:
+            tabla.colocar(r)
+
+    # Los avisos llegan en el hilo que hizo el cambio (importaciones, otras estaciones):
+    # fuera del hilo de Tk sólo se encolan y un sondeo con after los aplica.
+    cambios_pendientes = queue.Queue()
+    def al_cambiar_iph(operacion, filas):
+        if threading.current_thread() is threading.main_thread():
+            aplicar_cambio(operacion, filas)
+        else:
+            cambios_pendientes.put((operacion, filas))
+    def sondear_cambios():
+        while True:
+            try:
+                aplicar_cambio(*cambios_pendientes.get_nowait())
+            except queue.Empty:
+                break
+            except Exception as e:
+                print("Error aplicando cambio de IPH:", e)
+        tree.after(200, sondear_cambios)
+    sondear_cambios()
+    cancelar_aviso = suscribir_cambios_iph(al_cambiar_iph)
+    tree.bind("<Destroy>", lambda e: cancelar_aviso(), add="+")
+
     # Right-click menu on table for actions
     def ver_detalle():
         sel = tree.selection()
         if not sel: messagebox.showwarning("Ver detalle","Selecciona un registro"); return
-        item = tree.item(sel[0])["values"]
-        numero = item[1]
-        conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-        cur.execute("SELECT * FROM iph WHERE numero_informe=?", (numero,))
-        r = cur.fetchone(); conn.close()
+        r = cache_registros.leer(int(sel[0]))  # iid = id del IPH
         if not r: messagebox.showerror("Detalle","Registro no encontrado"); return
-        # r mapping based on create table
-        labels = ["ID","Número","Fecha","Denunciante","Tipo","TipoDelito","Lugar","Autoridad","Puesta a disposición",
-                  "Detenidos(JSON)","Vehículos(JSON)","Victima","Coordenadas","Estado","Observaciones","Capturado_por","Creado_en"]
+        r = dict(zip(IPH_COLUMNAS_DETALLE, r))
+        numero = r["numero_informe"]
+        labels = [("id","ID"),("numero_informe","Número"),("fecha_hechos","Fecha"),("denunciante","Denunciante"),
+                  ("tipo_hecho","Tipo"),("tipo_delito","TipoDelito"),("lugar","Lugar"),("autoridad","Autoridad"),
+                  ("puesta_a_disposicion","Puesta a disposición"),("detenidos_json","Detenidos(JSON)"),
+                  ("vehiculos_json","Vehículos(JSON)"),("victima","Victima"),("coordenadas","Coordenadas"),
+                  ("estado_procesal","Estado"),("observaciones","Observaciones"),("capturado_por","Capturado_por"),
+                  ("creado_en","Creado_en")]
         txt = ""
-        for i,lab in enumerate(labels):
-            val = r[i] if i < len(r) else ""
+        for col, lab in labels:
+            val = r[col] if r[col] is not None else ""
             txt += f"{lab}: {val}\n"
         # show in scrolled window
         dwin = tk.Toplevel(root); dwin.title(f"Detalle: {numero}"); dwin.geometry("700x500")
@@ -576,30 +2895,60 @@ def abrir_dashboard():
     def eliminar_registro():
         sel = tree.selection()
         if not sel: messagebox.showwarning("Eliminar","Selecciona un registro"); return
-        item = tree.item(sel[0])["values"]
-        numero = item[1]
-        if not messagebox.askyesno("Confirmar", f"Eliminar registro {numero}?"): return
-        conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-        cur.execute("DELETE FROM iph WHERE numero_informe=?", (numero,))
-        conn.commit(); conn.close()
-        registrar_auditoria("ELIMINAR", numero)
-        filtrar()
-        messagebox.showinfo("Eliminar","Registro eliminado")
+        pregunta = (f"Eliminar registro {tree.item(sel[0])['values'][1]}?" if len(sel) == 1
+                    else f"Eliminar {len(sel)} registros seleccionados?")
+        if not messagebox.askyesno("Confirmar", pregunta): return
+        borrados = eliminar_iph_lote(sel)
+        status_busqueda.config(text=f"{len(borrados)} registro(s) eliminado(s)")
+
+    def cambiar_estado():
+        sel = tree.selection()
+        if not sel: messagebox.showwarning("Cambiar estado","Selecciona uno o más registros"); return
+        dlg = tk.Toplevel(root); dlg.title("Cambiar estado procesal"); dlg.configure(bg="#14202b")
+        tk.Label(dlg, text=f"Nuevo estado para {len(sel)} registro(s):", bg="#14202b", fg="white").pack(padx=12, pady=8)
+        cb_estado = ttk.Combobox(dlg, values=ESTADOS_PROCESALES, width=28); cb_estado.pack(padx=12)
+        cb_estado.set(ESTADOS_PROCESALES[0])
+        def aplicar():
+            estado = cb_estado.get().strip()
+            if not estado: return
+            dlg.destroy()
+            filas = cambiar_estado_lote(sel, estado)
+            status_busqueda.config(text=f"{len(filas)} registro(s) en estado '{estado}'")
+        tk.Button(dlg, text="Aplicar", bg="#1abc9c", fg="white", command=aplicar).pack(pady=10)
+        dlg.transient(root); dlg.grab_set()
+
+    def exportar_seleccion():
+        sel = tree.selection()
+        if not sel: messagebox.showwarning("Exportar selección","Selecciona uno o más registros"); return
+        path = filedialog.asksaveasfilename(defaultextension=".xlsx",
+                                            filetypes=[("Excel","*.xlsx"), ("CSV","*.csv"), ("CSV comprimido","*.csv.gz")])
+        if not path: return
+        def terminado(filas, error):
+            if error is not None:
+                messagebox.showerror("Exportar selección", f"Error exportando: {error}")
+            elif filas is not None:
+                messagebox.showinfo("Exportar selección", f"Exportado a {path} ({filas} registros)")
+                registrar_auditoria("EXPORTAR_SELECCION", "-", f"{filas} registros")
+        ejecutar_con_progreso(root, "Exportando selección…",
+                              lambda progreso, cancelar: escribir_seleccion(path, sel, progreso, cancelar), terminado)
 
     menu = tk.Menu(root, tearoff=0)
     menu.add_command(label="Ver detalle", command=ver_detalle)
-    menu.add_command(label="Eliminar registro", command=eliminar_registro)
+    menu.add_separator()
+    menu.add_command(label="Eliminar seleccionados", command=eliminar_registro)
+    menu.add_command(label="Cambiar estado procesal…", command=cambiar_estado)
+    menu.add_command(label="Exportar selección…", command=exportar_seleccion)
     def on_right_click(event):
+        # clic derecho fuera de la selección actual la reemplaza por esa fila
+        fila = tree.identify_row(event.y)
+        if fila and fila not in tree.selection():
+            tree.selection_set(fila)
         try:
             menu.tk_popup(event.x_root, event.y_root)
         finally:
             menu.grab_release()
     tree.bind("<Button-3>", on_right_click)
 
-    # bottom status bar
-    status = tk.Label(root, text="Usuario: "+(current_user or "N/A"), bg="#0b1620", fg="white", anchor="w")
-    status.pack(side="bottom", fill="x")
-
     # start UI loop
     root.mainloop()
 
@@ -639,61 +2988,19 @@ def abrir_formulario_registro(parent):
     tk.Label(win, text="Número Detenidos (0-10)", bg="#14202b", fg="white").grid(row=5, column=0, padx=6, pady=6, sticky="e")
     var_nd = tk.IntVar(value=0); sb_nd = tk.Spinbox(win, from_=0, to=MAX_DETENIDOS, textvariable=var_nd, width=5); sb_nd.grid(row=5, column=1, padx=6, pady=6, sticky="w")
     frame_det = tk.Frame(win, bg="#14202b"); frame_det.grid(row=6, column=0, columnspan=5, sticky="w", padx=6)
-    det_fields = []
-    def upd_det(*args):
-        for w in frame_det.winfo_children(): w.destroy()
-        det_fields.clear()
-        for i in range(var_nd.get()):
-            tk.Label(frame_det, text=f"Det {i+1} Nombre:", bg="#14202b", fg="white").grid(row=i, column=0, padx=4, pady=2, sticky="e")
-            en = tk.Entry(frame_det, width=25); en.grid(row=i, column=1, padx=4, pady=2)
-            tk.Label(frame_det, text="Sexo:", bg="#14202b", fg="white").grid(row=i, column=2, padx=4, pady=2, sticky="e")
-            cb = ttk.Combobox(frame_det, values=["Hombre","Mujer"], width=10); cb.grid(row=i, column=3, padx=4, pady=2)
-            det_fields.append({"nombre": en, "sexo": cb})
-    var_nd.trace_add("write", lambda *args: upd_det())
+    pool_det = PoolFilas(frame_det, campos_detenido("Det {n}"))
+    enlazar_cantidad(var_nd, pool_det)
 
     # Vehículos dynamic
     tk.Label(win, text="Número Vehículos (0-10)", bg="#14202b", fg="white").grid(row=7, column=0, padx=6, pady=6, sticky="e")
     var_nv = tk.IntVar(value=0); sb_nv = tk.Spinbox(win, from_=0, to=MAX_VEHICULOS, textvariable=var_nv, width=5); sb_nv.grid(row=7, column=1, padx=6, pady=6, sticky="w")
     frame_veh = tk.Frame(win, bg="#14202b"); frame_veh.grid(row=8, column=0, columnspan=6, sticky="w", padx=6)
-    veh_fields = []
-    def upd_veh(*args):
-        for w in frame_veh.winfo_children(): w.destroy()
-        veh_fields.clear()
-        for i in range(var_nv.get()):
-            tk.Label(frame_veh, text=f"Veh {i+1} Tipo:", bg="#14202b", fg="white").grid(row=i, column=0, padx=4, pady=2, sticky="e")
-            cbt = ttk.Combobox(frame_veh, values=["Terrestre","Acuático","Aéreo"], width=12); cbt.grid(row=i, column=1, padx=4, pady=2)
-            tk.Label(frame_veh, text="Marca:", bg="#14202b", fg="white").grid(row=i, column=2, padx=4, pady=2, sticky="e")
-            em = tk.Entry(frame_veh, width=15); em.grid(row=i, column=3, padx=4, pady=2)
-            tk.Label(frame_veh, text="Placa:", bg="#14202b", fg="white").grid(row=i, column=4, padx=4, pady=2, sticky="e")
-            ep = tk.Entry(frame_veh, width=12); ep.grid(row=i, column=5, padx=4, pady=2)
-            tk.Label(frame_veh, text="Serie:", bg="#14202b", fg="white").grid(row=i, column=6, padx=4, pady=2, sticky="e")
-            es = tk.Entry(frame_veh, width=18); es.grid(row=i, column=7, padx=4, pady=2)
-            veh_fields.append({"tipo": cbt, "marca": em, "placa": ep, "serie": es})
-    var_nv.trace_add("write", lambda *args: upd_veh())
+    pool_veh = PoolFilas(frame_veh, campos_vehiculo("Veh {n}"))
+    enlazar_cantidad(var_nv, pool_veh)
 
     tk.Label(win, text="Observaciones", bg="#14202b", fg="white").grid(row=9, column=0, sticky="ne", padx=6, pady=6)
     tx_obs = tk.Text(win, width=80, height=6); tx_obs.grid(row=9, column=1, columnspan=6, padx=6, pady=6)
 
-    def recoger_det_fields():
-        out = []
-        for d in det_fields:
-            n = d["nombre"].get().strip()
-            s = d["sexo"].get().strip()
-            if n:
-                out.append({"nombre": n, "sexo": s})
-        return out
-
-    def recoger_veh_fields():
-        out = []
-        for v in veh_fields:
-            tipo = v["tipo"].get().strip()
-            marca = v["marca"].get().strip()
-            placa = v["placa"].get().strip()
-            serie = v["serie"].get().strip()
-            if tipo or marca or placa or serie:
-                out.append({"tipo": tipo, "marca": marca, "placa": placa, "serie": serie})
-        return out
-
     def guardar_desde_modal():
         datos = {
             "numero_informe": e_num.get().strip(),
@@ -706,8 +3013,8 @@ def abrir_formulario_registro(parent):
             "puesta_a_disposicion": e_puesta.get().strip(),
             "victima": e_vict.get().strip(),
             "coordenadas": e_coords.get().strip(),
-            "detenidos": recoger_det_fields(),
-            "vehiculos": recoger_veh_fields(),
+            "detenidos": detenidos_de(pool_det),
+            "vehiculos": vehiculos_de(pool_veh),
             "observaciones": tx_obs.get("1.0", tk.END).strip(),
             "estado_procesal": "En trámite",
             "creado_en": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -721,45 +3028,109 @@ def abrir_formulario_registro(parent):
 # -----------------------
 # Insertar IPH helper (guarda en DB)
 # -----------------------
-def insertar_iph(datos):
+_IPH_CAMPOS_ALTA = ("numero_informe", "fecha_hechos", "denunciante", "tipo_hecho", "tipo_delito", "lugar", "autoridad",
+                    "puesta_a_disposicion", "detenidos_json", "vehiculos_json", "victima", "coordenadas",
+                    "estado_procesal", "observaciones", "capturado_por", "creado_en")
+# Lo que una nueva captura del mismo número reemplaza (se conservan quién y cuándo se creó).
+_IPH_CAMPOS_UPSERT = _IPH_CAMPOS_ALTA[1:14]
+POLITICAS_DUPLICADO = ("rechazar", "actualizar")
+
+def _motivo_invalido(datos):
+    if not isinstance(datos, dict): return "no es un objeto"
+    if not datos.get("numero_informe"): return "sin numero_informe"
+    if not validar_fecha(datos.get("fecha_hechos", "")): return "fecha_hechos inválida (YYYY-MM-DD)"
+    if not datos.get("denunciante") or not datos.get("tipo_hecho"): return "faltan denunciante o tipo_hecho"
+    return None
+
+def _valores_alta(datos, ahora):
+    # fecha_hechos se guarda con ceros ("2024-1-5" -> "2024-01-05"): los rollups de día/semana/mes la cortan como texto
+    fecha = datetime.datetime.strptime(datos["fecha_hechos"], "%Y-%m-%d").strftime("%Y-%m-%d")
+    return [str(datos["numero_informe"]), fecha, datos["denunciante"], datos["tipo_hecho"],
+            datos.get("tipo_delito",""), datos.get("lugar",""), datos.get("autoridad",""), datos.get("puesta_a_disposicion",""),
+            json.dumps(datos.get("detenidos",[]), ensure_ascii=False), json.dumps(datos.get("vehiculos",[]), ensure_ascii=False),
+            datos.get("victima",""), datos.get("coordenadas",""), datos.get("estado_procesal","En trámite"),
+            datos.get("observaciones",""), datos.get("capturado_por") or current_user or "", datos.get("creado_en", ahora)]
+
+def insertar_iph_many(registros, politica="rechazar", lote=500):
+    # Alta por lotes apoyada en UNIQUE(numero_informe): un INSERT … SELECT FROM json_each(?) … ON CONFLICT
+    # … RETURNING por lote, sin SELECT previo. politica: "rechazar" deja el registro existente,
+    # "actualizar" lo reemplaza. Devuelve {"insertados": [filas], "actualizados": [filas],
+    # "rechazados": [(n, numero_informe, motivo)]} con filas en IPH_COLUMNAS_DETALLE.
+    if politica not in POLITICAS_DUPLICADO:
+        raise ValueError(f"politica debe ser una de {POLITICAS_DUPLICADO}")
+    if politica == "actualizar":
+        conflicto = "DO UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in _IPH_CAMPOS_UPSERT)
+    else:
+        conflicto = "DO NOTHING"
+    sql = (f"INSERT INTO iph ({', '.join(_IPH_CAMPOS_ALTA)}) SELECT "
+           + ", ".join(f"json_extract(value, '$[{k}]')" for k in range(len(_IPH_CAMPOS_ALTA)))
+           + f" FROM json_each(?) WHERE true ON CONFLICT(numero_informe) {conflicto} "
+           + "RETURNING " + ", ".join(IPH_COLUMNAS_DETALLE))
+    ahora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    res = {"insertados": [], "actualizados": [], "rechazados": []}
+    # un mismo número repetido en la entrada: gana el primero (rechazar) o el último (actualizar)
+    validos = {}
+    for n, datos in enumerate(registros, 1):
+        motivo = _motivo_invalido(datos)
+        if motivo:
+            res["rechazados"].append((n, datos.get("numero_informe") if isinstance(datos, dict) else None, motivo)); continue
+        num = str(datos["numero_informe"])
+        if num in validos:
+            if politica == "rechazar":
+                res["rechazados"].append((n, num, "duplicado en el lote")); continue
+            del validos[num]
+        validos[num] = (n, datos)
+    pendientes = list(validos.items())
+    with conexion_db() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        # ids por encima de este valor son altas; los demás, registros existentes actualizados
+        fila = cur.execute("SELECT seq FROM sqlite_sequence WHERE name='iph'").fetchone()
+        ultimo_id = fila[0] if fila else 0
+        for i in range(0, len(pendientes), lote):
+            bloque = pendientes[i:i+lote]
+            filas = cur.execute(sql, (json.dumps([_valores_alta(d, ahora) for _, (_, d) in bloque], ensure_ascii=False),)).fetchall()
+            hechos = {r[1]: r for r in filas}
+            for num, (n, _) in bloque:
+                if num not in hechos: res["rechazados"].append((n, num, "numero_informe ya existe"))
+            guardar_hijos_lote(cur, [(r[0], validos[r[1]][1].get("detenidos",[]), validos[r[1]][1].get("vehiculos",[]))
+                                     for r in filas])
+            for r in filas:
+                res["insertados" if r[0] > ultimo_id else "actualizados"].append(r)
+        conn.commit()
+    res["rechazados"].sort()
+    hechos = res["insertados"] + res["actualizados"]
+    cache_registros.guardar(hechos)
+    for accion, clave in (("INSERTAR", "insertados"), ("ACTUALIZAR", "actualizados")):
+        for r in res[clave]:
+            registrar_auditoria(accion, r[1], json.dumps(validos[r[1]][1], ensure_ascii=False))
+    notificar_cambio_iph("I", res["insertados"])
+    notificar_cambio_iph("U", res["actualizados"])
+    if hechos:
+        solicitar_backup_incremental()  # backup incremental agrupado, en segundo plano
+        avisar_sincronizacion()         # la bandeja iph_salida ya tiene estos registros
+    return res
+
+def insertar_iph(datos, politica="rechazar"):
     # basic validation
-    if not datos.get("numero_informe") or not validar_fecha(datos.get("fecha_hechos","")) or not datos.get("denunciante") or not datos.get("tipo_hecho"):
+    if _motivo_invalido(datos):
         messagebox.showwarning("Validación", "Revisa campos obligatorios y formatos (fecha YYYY-MM-DD).")
         return
-    conectar_db()
-    conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-    # duplicado?
-    cur.execute("SELECT id FROM iph WHERE numero_informe=?", (datos["numero_informe"],))
-    if cur.fetchone():
-        messagebox.showerror("Duplicado", f"Número de informe {datos['numero_informe']} ya existe.")
-        conn.close(); return
     try:
-        cur.execute("""INSERT INTO iph
-            (numero_informe, fecha_hechos, denunciante, tipo_hecho, tipo_delito, lugar, autoridad, puesta_a_disposicion,
-             detenidos_json, vehiculos_json, victima, coordenadas, estado_procesal, observaciones, capturado_por, creado_en)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
-            datos["numero_informe"], datos["fecha_hechos"], datos["denunciante"], datos["tipo_hecho"], datos.get("tipo_delito",""),
-            datos.get("lugar",""), datos.get("autoridad",""), datos.get("puesta_a_disposicion",""),
-            json.dumps(datos.get("detenidos",[]), ensure_ascii=False), json.dumps(datos.get("vehiculos",[]), ensure_ascii=False),
-            datos.get("victima",""), datos.get("coordenadas",""), datos.get("estado_procesal","En trámite"),
-            datos.get("observaciones",""), current_user or "", datos.get("creado_en", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        ))
-        conn.commit()
-        messagebox.showinfo("Guardado", "IPH guardado correctamente.")
-        registrar_auditoria("INSERTAR", datos["numero_informe"], json.dumps(datos, ensure_ascii=False))
-        # backup in background
-        threading.Thread(target=guardar_backup_excel, daemon=True).start()
+        res = insertar_iph_many([datos], politica)
     except Exception as e:
         messagebox.showerror("Error guardado", str(e))
-    finally:
-        conn.close()
+        return
+    if res["rechazados"]:
+        messagebox.showerror("Duplicado", f"Número de informe {datos['numero_informe']} ya existe.")
+        return
+    messagebox.showinfo("Guardado", "IPH guardado correctamente." if res["insertados"] else "IPH actualizado.")
+    return (res["insertados"] or res["actualizados"])[0][0]
 
 # -----------------------
 # Login & Registro UI
 # -----------------------
 def abrir_login():
-    conectar_db()
     # ensure at least one admin user exists? Not automatically for security.
     login = tk.Tk()
     login.title("Login - IPH")
@@ -776,16 +3147,15 @@ def abrir_login():
         u = e_user.get().strip(); pw = e_pw.get().strip()
         if not u or not pw:
             messagebox.showwarning("Login","Ingresa usuario y contraseña"); return
-        conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-        cur.execute("SELECT usuario FROM usuarios WHERE usuario=? AND password=?", (u, hash_password(pw)))
-        if cur.fetchone():
+        with conexion_db() as conn:
+            ok = conn.execute("SELECT usuario FROM usuarios WHERE usuario=? AND password=?", (u, hash_password(pw))).fetchone()
+        if ok:
             current_user = u
             registrar_auditoria("LOGIN", "-")
             login.destroy()
             abrir_dashboard()
         else:
             messagebox.showerror("Login", "Usuario o contraseña incorrectos")
-        conn.close()
 
     btn_login = tk.Button(login, text="Ingresar", bg="#1abc9c", fg="white", command=intentar_login)
     btn_login.pack(pady=10)
@@ -813,7 +3183,16 @@ def abrir_login():
                   command=lambda: messagebox.showinfo("Recuperar", "Simulación: revisa tu correo (simulado).")).pack(pady=12)
     tk.Button(login, text="Registrar usuario", bg="#2196f3", fg="white", command=abrir_registro).pack(pady=6)
     tk.Button(login, text="Recuperar contraseña (simulado)", bg="#e67e22", fg="white", command=abrir_recuperar).pack(pady=6)
-
+    marcar_arranque("ventana de login")
+
+    def ventana_visible():
+        # el esquema se verifica con la ventana ya pintada
+        marcar_arranque("primer pintado")
+        conectar_db()
+        marcar_arranque("esquema de la base")
+        if PERFIL_ARRANQUE:
+            print(reporte_arranque())
+    login.after_idle(ventana_visible)
     login.mainloop()
 
 def registrar_usuario(usuario, password, correo):
@@ -821,20 +3200,19 @@ def registrar_usuario(usuario, password, correo):
         messagebox.showwarning("Registro", "Usuario y contraseña obligatorios")
         return False
     try:
-        conn = sqlite3.connect(resource_path(DB_NAME)); cur = conn.cursor()
-        cur.execute("INSERT INTO usuarios (usuario, password, correo) VALUES (?,?,?)",
-                    (usuario, hash_password(password), correo or None))
-        conn.commit(); conn.close()
+        with conexion_db() as conn:
+            conn.execute("INSERT INTO usuarios (usuario, password, correo) VALUES (?,?,?)",
+                         (usuario, hash_password(password), correo or None))
         messagebox.showinfo("Registro", "Usuario registrado")
         return True
     except sqlite3.IntegrityError:
         messagebox.showerror("Registro", "Usuario o correo ya existe"); return False
 
-# -----------------------
-# Starter
-# -----------------------
-if __name__ == "__main__":
-    abrir_login()
+# Los bloques añadidos abajo redefinen DB_NAME y registrar_auditoria; el arranque (al final
+# del archivo) vuelve a fijar los de esta parte para que la sesión use iph.db y la cola de auditoría.
+_DB_PRINCIPAL = DB_NAME
+_registrar_auditoria_principal = registrar_auditoria
+
 # ===================== MEJORAS ADICIONALES COMPLETAS =====================
 # Autor: ChatGPT - GPT-5
 # Fecha: Octubre 2025
@@ -847,19 +3225,13 @@ import sqlite3
 import threading
 import datetime
 import traceback
-import pandas as pd
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
 from pathlib import Path
 import hashlib
 import logging
-import folium
 import webbrowser
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
 import zipfile
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 # ============================================================
 # CONFIGURACIÓN GENERAL
@@ -919,17 +3291,8 @@ def log_audit(accion, tabla, registro_id=0, usuario=None):
     try:
         usuario = usuario or current_user
         fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn = get_db_connection()
-        if conn:
-            c = conn.cursor()
-            c.execute("""CREATE TABLE IF NOT EXISTS audit (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            accion TEXT, tabla TEXT,
-                            registro_id INTEGER, usuario TEXT, fecha TEXT)""")
-            c.execute("INSERT INTO audit (accion, tabla, registro_id, usuario, fecha) VALUES (?,?,?,?,?)",
-                      (accion, tabla, registro_id, usuario, fecha))
-            conn.commit()
-            conn.close()
+        cola_auditoria.sql("INSERT INTO audit (accion, tabla, registro_id, usuario, fecha) VALUES (?,?,?,?,?)",
+                           (accion, tabla, registro_id, usuario, fecha))
         log_event(f"Auditoría: {accion} en {tabla}")
     except Exception as e:
         log_error(e)
@@ -940,35 +3303,17 @@ def log_audit(accion, tabla, registro_id=0, usuario=None):
 
 def backup_db_advanced():
     try:
-        BACKUP_DIR.mkdir(exist_ok=True)
-        today = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        backup_file = BACKUP_DIR / f"backup_{today}.db"
-        conn = sqlite3.connect(DB_NAME)
-        bck = sqlite3.connect(backup_file)
-        with bck:
-            conn.backup(bck)
-        bck.close()
-        conn.close()
-        backups = sorted(BACKUP_DIR.glob("backup_*.db"), key=os.path.getmtime, reverse=True)
-        for old in backups[10:]:
-            old.unlink()
-        log_event(f"Backup exitoso: {backup_file}")
-        log_audit("Backup", "sistema")
+        backup_file = programador_backups.backup_completo()
+        if backup_file:
+            log_event(f"Backup exitoso: {backup_file}")
+            log_audit("Backup", "sistema")
     except Exception as e:
         log_error(e)
 
 def start_safe_backup_thread():
-    def loop():
-        while True:
-            try:
-                backup_db_advanced()
-            except Exception as e:
-                log_error(e)
-            finally:
-                threading.Event().wait(86400)
-    threading.Thread(target=loop, daemon=True).start()
+    programador_backups.iniciar()
 
-start_safe_backup_thread()
+al_iniciar_sesion(start_safe_backup_thread)
 
 # ============================================================
 # VALIDACIÓN DE FORMULARIOS
@@ -987,9 +3332,8 @@ def validar_campos(campos):
 
 def export_json():
     try:
-        conn = get_db_connection()
-        df = pd.read_sql("SELECT * FROM iph_records", conn)
-        conn.close()
+        with conexion_db() as conn:
+            df = pd.read_sql("SELECT * FROM iph_records", conn)
         if df.empty:
             messagebox.showinfo("Exportar JSON", "No hay datos para exportar.")
             return
@@ -1005,17 +3349,27 @@ def import_json():
     try:
         filename = filedialog.askopenfilename(filetypes=[("Archivos JSON", "*.json")])
         if not filename: return
-        data = pd.read_json(filename)
-        conn = get_db_connection()
-        c = conn.cursor()
-        for _, row in data.iterrows():
-            c.execute("""INSERT INTO iph_records (fecha, detenido, vehiculo, coordenadas, usuario)
-                         VALUES (?,?,?,?,?)""",
-                      (row.get("fecha"), row.get("detenido"), row.get("vehiculo"),
-                       row.get("coordenadas"), row.get("usuario","importado")))
-        conn.commit()
-        conn.close()
-        messagebox.showinfo("Importar JSON", f"Datos importados correctamente desde {filename}")
+        t0 = time.perf_counter()
+        insertados, rechazos, lote = 0, [], []
+        sql = """INSERT INTO iph_records (fecha, detenido, vehiculo, coordenadas, usuario)
+                 VALUES (?,?,?,?,?)"""
+        with conexion_db() as conn:
+            for n, row, _ in leer_registros_json(filename):
+                if not isinstance(row, dict):
+                    rechazos.append({"registro": n, "motivo": str(row) if isinstance(row, Exception) else "no es un objeto"})
+                    continue
+                lote.append((row.get("fecha"), row.get("detenido"), row.get("vehiculo"),
+                             row.get("coordenadas"), row.get("usuario","importado")))
+                if len(lote) >= JSON_LOTE:
+                    conn.executemany(sql, lote); conn.commit()
+                    insertados += len(lote); lote = []
+            if lote:
+                conn.executemany(sql, lote); insertados += len(lote)
+        seg = time.perf_counter() - t0
+        texto = f"Datos importados correctamente desde {filename}\n{insertados} registros ({insertados / max(seg, 1e-6):.0f}/s)"
+        archivo = _guardar_rechazos(filename, rechazos)
+        if archivo: texto += f"\nRechazados: {len(rechazos)} → {archivo}"
+        messagebox.showinfo("Importar JSON", texto)
         log_audit("Importar", "iph_records")
     except Exception as e:
         log_error(e)
@@ -1026,21 +3380,9 @@ def import_json():
 
 def mapa_global_registros():
     try:
-        conn = get_db_connection()
-        df = pd.read_sql("SELECT detenido, coordenadas FROM iph_records WHERE coordenadas != ''", conn)
-        conn.close()
-        if df.empty:
+        if not mapa_global("mapa_global_registros.html"):
             messagebox.showinfo("Mapa Global", "No hay registros con coordenadas.")
             return
-        m = folium.Map(location=[19.43, -99.13], zoom_start=6)
-        for _, row in df.iterrows():
-            try:
-                lat, lon = map(float, row["coordenadas"].split(","))
-                folium.Marker([lat, lon], popup=row["detenido"] or "Sin nombre").add_to(m)
-            except: continue
-        output_file = "mapa_global_registros.html"
-        m.save(output_file)
-        webbrowser.open(output_file)
         log_event("Mapa global generado")
     except Exception as e:
         log_error(e)
@@ -1051,11 +3393,8 @@ def mapa_global_registros():
 
 def es_admin(usuario):
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute("SELECT rol FROM users WHERE username=?", (usuario,))
-        rol = c.fetchone()
-        conn.close()
+        with conexion_db() as conn:
+            rol = conn.execute("SELECT rol FROM users WHERE username=?", (usuario,)).fetchone()
         return rol and rol[0]=="admin"
     except:
         return False
@@ -1066,6 +3405,7 @@ def mostrar_menu_avanzado(menubar):
     menu_avanzado.add_command(label="📈 Generar estadísticas de usuarios", command=generar_estadisticas_usuarios)
     menu_avanzado.add_command(label="🗺️ Ver mapa global de registros", command=mapa_global_registros)
     menu_avanzado.add_command(label="🧹 Compactar backups antiguos", command=compactar_backups_antiguos)
+    menu_avanzado.add_command(label="🔍 Verificar almacén de backups", command=verificar_almacen_backups)
     menu_avanzado.add_command(label="🧰 Diagnóstico del sistema", command=ejecutar_diagnostico)
     menu_avanzado.add_command(label="🧑‍💼 Panel de Administración", command=abrir_panel_admin)
     menu_avanzado.add_command(label="📊 Reportes Inteligentes", command=abrir_reportes_admin)
@@ -1080,28 +3420,32 @@ def ejecutar_diagnostico():
     issues = []
     for folder in [ICON_DIR, BACKUP_DIR]:
         if not folder.exists(): issues.append(f"❌ Falta carpeta: {folder}")
-    conn = get_db_connection()
     try:
-        c = conn.cursor()
-        for table in ["users","iph_records","audit"]:
-            c.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'")
-            if not c.fetchone(): issues.append(f"⚠️ Tabla faltante: {table}")
+        with conexion_db() as conn:
+            c = conn.cursor()
+            for table in ["users","iph_records","audit"]:
+                c.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'")
+                if not c.fetchone(): issues.append(f"⚠️ Tabla faltante: {table}")
     except Exception as e:
         issues.append(f"Error en DB: {e}")
-    if issues: messagebox.showwarning("Diagnóstico", "\n".join(issues))
-    else: messagebox.showinfo("Diagnóstico", "✅ Todo correcto")
+    if issues: messagebox.showwarning("Diagnóstico", "\n".join(issues + [describir_estado_backups()]))
+    else: messagebox.showinfo("Diagnóstico", "✅ Todo correcto\n" + describir_estado_backups())
     log_event("Diagnóstico ejecutado")
 
 def compactar_backups_antiguos():
     try:
-        backups = sorted(BACKUP_DIR.glob("backup_*.db"), key=os.path.getmtime)
-        if len(backups)<=5: return
-        for archivo in backups[:-5]:
-            zip_name = archivo.with_suffix(".zip")
-            with zipfile.ZipFile(zip_name,"w",zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(archivo, arcname=archivo.name)
-            archivo.unlink()
-        log_event("Backups antiguos comprimidos")
+        movidos = compactar_en_almacen()
+        log_event(f"Backups antiguos movidos al almacén deduplicado: {movidos}")
+    except Exception as e:
+        log_error(e)
+
+def verificar_almacen_backups():
+    try:
+        problemas = almacen_backups.verificar()
+        total = len(almacen_backups.instantaneas())
+        if problemas: messagebox.showwarning("Verificar backups", "\n".join(problemas[:20]))
+        else: messagebox.showinfo("Verificar backups", f"✅ {total} instantáneas íntegras")
+        log_event(f"Almacén de backups verificado: {total} instantáneas, {len(problemas)} problemas")
     except Exception as e:
         log_error(e)
 
@@ -1111,16 +3455,11 @@ def compactar_backups_antiguos():
 
 def generar_estadisticas_usuarios():
     try:
-        conn = get_db_connection()
-        df = pd.read_sql("SELECT usuario, fecha FROM iph_records", conn)
-        conn.close()
-        if df.empty:
+        resumen = leer_estadisticas()["por_usuario"]
+        if resumen.empty:
             messagebox.showinfo("Estadísticas","No hay datos")
             return
-        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-        resumen = df.groupby("usuario").agg(Total_Registros=("usuario","count"),
-                                           Primer_Registro=("fecha","min"),
-                                           Último_Registro=("fecha","max")).reset_index()
+        resumen.columns = ["usuario", "Total_Registros", "Primer_Registro", "Último_Registro"]
         output = Path.cwd() / f"estadisticas_usuarios_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         resumen.to_excel(output, index=False)
         messagebox.showinfo("Estadísticas generadas", f"Archivo: {output}")
@@ -1147,9 +3486,8 @@ def abrir_panel_admin():
         tree.heading("Rol", text="Rol")
         tree.pack(expand=True, fill="both", pady=10)
 
-        conn = get_db_connection()
-        df = pd.read_sql("SELECT username, rol FROM users", conn)
-        conn.close()
+        with conexion_db() as conn:
+            df = pd.read_sql("SELECT username, rol FROM users", conn)
         for _, row in df.iterrows():
             tree.insert("",tk.END, values=(row["username"], row["rol"]))
 
@@ -1169,29 +3507,49 @@ def abrir_reportes_admin():
             return
         reporte = tk.Toplevel()
         reporte.title("Reportes Inteligentes")
-        reporte.geometry("700x500")
+        reporte.geometry("760x540")
         tk.Label(reporte,text="Reportes Inteligentes - IPH", font=("Arial",14)).pack(pady=10)
 
-        conn = get_db_connection()
-        df = pd.read_sql("SELECT fecha, detenido, vehiculo, usuario FROM iph_records", conn)
-        conn.close()
-        if df.empty:
+        primero, ultimo = rango_estadisticas()
+        if not primero:
             tk.Label(reporte,text="No hay datos para mostrar.", fg="red").pack(pady=20)
             return
 
-        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-        df_count = df.groupby(df["fecha"].dt.date).size()
-        fig, ax = plt.subplots(figsize=(6,3))
-        df_count.plot(kind="bar", ax=ax)
-        ax.set_title("Registros por día")
-        ax.set_xlabel("Fecha")
-        ax.set_ylabel("Cantidad")
-
+        controles = tk.Frame(reporte); controles.pack(fill="x", padx=10)
+        tk.Label(controles, text="Desde:").pack(side="left")
+        e_desde = DateEntry(controles, date_pattern="yyyy-mm-dd"); e_desde.pack(side="left", padx=4)
+        e_desde.set_date(primero)
+        tk.Label(controles, text="Hasta:").pack(side="left")
+        e_hasta = DateEntry(controles, date_pattern="yyyy-mm-dd"); e_hasta.pack(side="left", padx=4)
+        e_hasta.set_date(ultimo)
+        opciones = {"Automática": "auto", "Día": "dia", "Semana": "semana", "Mes": "mes"}
+        cb_gran = ttk.Combobox(controles, values=list(opciones), width=11, state="readonly")
+        cb_gran.set("Automática"); cb_gran.pack(side="left", padx=8)
+
+        fig, ax = plt.subplots(figsize=(7,3.4))
         canvas_fig = FigureCanvasTkAgg(fig, master=reporte)
-        canvas_fig.draw()
         canvas_fig.get_tk_widget().pack(expand=True, fill="both", pady=10)
-
-        tk.Button(reporte, text="Cerrar", command=reporte.destroy).pack(pady=5)
+        lbl_info = tk.Label(reporte, text="", fg="gray"); lbl_info.pack()
+
+        def dibujar(event=None):
+            t0 = time.perf_counter()
+            serie, gran = serie_temporal(e_desde.get_date(), e_hasta.get_date(), opciones[cb_gran.get()])
+            ax.clear()
+            ancho = (serie["periodo"].iloc[1] - serie["periodo"].iloc[0]).days * 0.8 if len(serie) > 1 else 0.8
+            ax.bar(serie["periodo"], serie["total"], width=ancho, align="edge")
+            ax.set_title(f"Registros por periodo ({gran})")
+            ax.set_xlabel("Fecha")
+            ax.set_ylabel("Cantidad")
+            fig.autofmt_xdate()
+            canvas_fig.draw_idle()
+            lbl_info.config(text=f"{len(serie)} puntos · {int(serie['total'].sum())} registros · "
+                                 f"{(time.perf_counter() - t0) * 1000:.0f} ms")
+
+        tk.Button(controles, text="Actualizar", command=dibujar).pack(side="left", padx=4)
+        cb_gran.bind("<<ComboboxSelected>>", dibujar)
+        dibujar()
+
+        tk.Button(reporte, text="Cerrar", command=lambda: (plt.close(fig), reporte.destroy())).pack(pady=5)
         log_event("Reportes Inteligentes abiertos")
     except Exception as e:
         log_error(e)
@@ -1207,16 +3565,10 @@ import hashlib
 import threading
 import datetime
 import traceback
-import pandas as pd
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-import folium
 import webbrowser
 import logging
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from pathlib import Path
 import zipfile
 
@@ -1278,8 +3630,7 @@ def registrar_logout(username):
 def registrar_auditoria(usuario, accion, detalles=""):
     fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     registro = f"{fecha} | {usuario} | {accion} | {detalles}\n"
-    with open("auditoria.txt", "a", encoding="utf-8") as f:
-        f.write(registro)
+    cola_auditoria.texto(os.path.abspath("auditoria.txt"), registro)
 
 # ----------------------------
 # BACKUPS AUTOMÁTICOS
@@ -1289,47 +3640,21 @@ DB_NAME = "iph_database.db"
 
 def backup_db_advanced():
     try:
-        BACKUP_DIR.mkdir(exist_ok=True)
-        today = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        backup_file = BACKUP_DIR / f"backup_{today}.db"
-        conn = sqlite3.connect(DB_NAME)
-        bck = sqlite3.connect(backup_file)
-        with bck:
-            conn.backup(bck)
-        bck.close()
-        conn.close()
-        backups = sorted(BACKUP_DIR.glob("backup_*.db"), key=os.path.getmtime, reverse=True)
-        for old in backups[10:]:
-            old.unlink()
-        log_event(f"Backup avanzado creado: {backup_file}")
+        backup_file = programador_backups.backup_completo()
+        if backup_file:
+            log_event(f"Backup avanzado creado: {backup_file}")
     except Exception as e:
         log_error(e)
 
 def iniciar_backup_diario():
-    def loop():
-        while True:
-            try:
-                backup_db_advanced()
-            except Exception as e:
-                log_error(e)
-            finally:
-                threading.Event().wait(86400)  # 24 horas
-    threading.Thread(target=loop, daemon=True).start()
+    programador_backups.iniciar()
 
-iniciar_backup_diario()
+al_iniciar_sesion(iniciar_backup_diario)
 
 def compactar_backups_antiguos():
     try:
-        backups = sorted(BACKUP_DIR.glob("backup_*.db"), key=os.path.getmtime)
-        if len(backups) <= 5:
-            return
-        antiguos = backups[:-5]
-        for archivo in antiguos:
-            zip_name = archivo.with_suffix(".zip")
-            with zipfile.ZipFile(zip_name, "w", zipfile.ZIP_DEFLATED) as zipf:
-                zipf.write(archivo, arcname=archivo.name)
-            archivo.unlink()
-        log_event("Backups antiguos comprimidos correctamente.")
+        movidos = compactar_en_almacen()
+        log_event(f"Backups antiguos movidos al almacén deduplicado: {movidos}")
     except Exception as e:
         log_error(e)
 
@@ -1349,24 +3674,53 @@ def validar_campos(campos):
 # ----------------------------
 # EXPORTACIONES
 # ----------------------------
-def exportar_a_excel(df, nombre_archivo="export.xlsx"):
+def escribir_excel_df(path, df, progreso=None, cancelar=None, tam_bloque=5000):
+    # Como escribir_tabla pero desde un DataFrame: por bloques, con avance, cancelable y vía archivo temporal.
+    from openpyxl import Workbook
+    tmp = path + ".tmp"
+    wb = Workbook(write_only=True); ws = wb.create_sheet("Hoja1")
+    ws.append([str(c) for c in df.columns])
     try:
-        df.to_excel(nombre_archivo, index=False)
+        for i in range(0, len(df), tam_bloque):
+            if cancelar is not None and cancelar.is_set():
+                for hoja in wb.worksheets: hoja.close()
+                return None
+            bloque = df.iloc[i:i + tam_bloque]
+            for fila in bloque.astype(object).where(bloque.notna(), None).values.tolist():
+                ws.append(fila)
+            if progreso: progreso(min(i + tam_bloque, len(df)), len(df))
+        wb.save(tmp)
+        os.replace(tmp, path)
+        return len(df)
+    finally:
+        if os.path.exists(tmp):
+            try: os.remove(tmp)
+            except OSError: pass
+
+def exportar_a_excel(df, nombre_archivo="export.xlsx"):
+    def terminado(filas, error):
+        if error is not None:
+            log_error(error); messagebox.showerror("Error", "Error exportando a Excel"); return
+        if filas is None: return
         log_event(f"Exportación a Excel: {nombre_archivo}")
         messagebox.showinfo("Exportación", f"Datos exportados a {nombre_archivo}")
-    except Exception as e:
-        log_error(e)
-        messagebox.showerror("Error", "Error exportando a Excel")
+    ejecutar_con_progreso(None, "Exportando a Excel…",
+                          lambda progreso, cancelar: escribir_excel_df(nombre_archivo, df, progreso, cancelar), terminado)
 
 def exportar_a_pdf(df, nombre_archivo="export.pdf"):
     try:
-        from reportlab.platypus import SimpleDocTemplate, Table
-        doc = SimpleDocTemplate(nombre_archivo, pagesize=letter)
-        data = [df.columns.tolist()] + df.values.tolist()
-        table = Table(data)
-        doc.build([table])
-        log_event(f"Exportación a PDF: {nombre_archivo}")
-        messagebox.showinfo("Exportación", f"Datos exportados a {nombre_archivo}")
+        bloques = (df.iloc[i:i + 2000].values.tolist() for i in range(0, len(df), 2000))
+        def terminado(filas, error):
+            if error is not None:
+                log_error(error); messagebox.showerror("Error", "Error exportando a PDF"); return
+            if filas is None: return
+            log_event(f"Exportación a PDF: {nombre_archivo}")
+            messagebox.showinfo("Exportación", f"Datos exportados a {nombre_archivo}")
+        ejecutar_con_progreso(None, "Exportando a PDF…",
+                              lambda progreso, cancelar: escribir_pdf_tabla(
+                                  nombre_archivo, "Exportación IPH", [str(c) for c in df.columns], bloques,
+                                  len(df), progreso=progreso, cancelar=cancelar),
+                              terminado)
     except Exception as e:
         log_error(e)
         messagebox.showerror("Error", "Error exportando a PDF")
@@ -1376,18 +3730,12 @@ def exportar_a_pdf(df, nombre_archivo="export.pdf"):
 # ----------------------------
 def generar_estadisticas_realtime():
     try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql_query("SELECT usuario, vehiculo FROM iph_records", conn)
-        conn.close()
-        if df.empty:
+        file_resumen = f"estadisticas_realtime_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        stats = escribir_estadisticas(file_resumen)
+        if stats["por_tipo"].empty:
+            os.remove(file_resumen)
             messagebox.showinfo("Estadísticas", "No hay registros para generar estadísticas.")
             return
-        resumen_usuario = df.groupby("usuario").size().reset_index(name="Total_Registros")
-        resumen_tipo = df.groupby("vehiculo").size().reset_index(name="Total_Registros")
-        file_resumen = f"estadisticas_realtime_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        with pd.ExcelWriter(file_resumen) as writer:
-            resumen_usuario.to_excel(writer, sheet_name="Por Usuario", index=False)
-            resumen_tipo.to_excel(writer, sheet_name="Por Tipo", index=False)
         messagebox.showinfo("Estadísticas generadas", f"Archivo generado:\n{file_resumen}")
         log_event("Estadísticas en tiempo real generadas.")
     except Exception as e:
@@ -1396,76 +3744,46 @@ def generar_estadisticas_realtime():
 
 def mapa_global_interactivo():
     try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql_query("SELECT detenido, coordenadas FROM iph_records WHERE coordenadas != ''", conn)
-        conn.close()
-        if df.empty:
-            messagebox.showinfo("Mapa Global", "No hay registros con coordenadas.")
-            return
-        latitudes = []
-        longitudes = []
-        for coord in df["coordenadas"]:
-            try:
-                lat, lon = map(float, coord.split(","))
-                latitudes.append(lat)
-                longitudes.append(lon)
-            except:
-                continue
-        if not latitudes or not longitudes:
+        if not mapa_global("mapa_global_interactivo.html"):
             messagebox.showinfo("Mapa Global", "No hay coordenadas válidas.")
             return
-        lat_centro = sum(latitudes)/len(latitudes)
-        lon_centro = sum(longitudes)/len(longitudes)
-        m = folium.Map(location=[lat_centro, lon_centro], zoom_start=5, tiles="OpenStreetMap")
-        for _, row in df.iterrows():
-            try:
-                lat, lon = map(float, row["coordenadas"].split(","))
-                folium.Marker(location=[lat, lon],
-                              popup=row["detenido"] or "Sin nombre",
-                              icon=folium.Icon(color="red", icon="info-sign")).add_to(m)
-            except:
-                continue
-        mapa_file = "mapa_global_interactivo.html"
-        m.save(mapa_file)
-        webbrowser.open(mapa_file)
         log_event("Mapa global interactivo generado.")
     except Exception as e:
         log_error(e)
         messagebox.showerror("Error", f"No se pudo generar el mapa interactivo: {e}")
 
-def monitorear_registros(intervalo_segundos=300):
+def monitorear_registros(intervalo_segundos=300, archivo="estadisticas_realtime.xlsx"):
+    # Reescribe un único xlsx sólo cuando la bitácora de cambios avanzó; sin ventanas desde el hilo.
     def loop():
+        vista = None
         while True:
             try:
-                generar_estadisticas_realtime()
+                marca = marca_cambios()
+                if marca != vista:
+                    escribir_estadisticas(archivo)
+                    vista = marca
+                    log_event(f"Estadísticas actualizadas ({archivo})")
             except Exception as e:
                 log_error(e)
             finally:
                 threading.Event().wait(intervalo_segundos)
     threading.Thread(target=loop, daemon=True).start()
 
-monitorear_registros()
+al_iniciar_sesion(monitorear_registros)
 
 # ----------------------------
 # INICIALIZACIÓN DEL SISTEMA MEJORADO
 # ----------------------------
 def verificar_integridad():
-    missing = []
-    for folder in [BACKUP_DIR]:
-        if not folder.exists():
-            missing.append(str(folder))
-    if missing:
-        messagebox.showwarning("Integridad del Sistema",
-                               f"Se detectaron carpetas faltantes:\n{chr(10).join(missing)}\nSe crearán automáticamente.")
-        for path in missing:
-            Path(path).mkdir(parents=True, exist_ok=True)
+    # En una instalación nueva las carpetas aún no existen: se crean sin avisar
+    # (el bloque de mejoras avanzadas redefine BACKUP_DIR como str).
+    Path(BACKUP_DIR).mkdir(parents=True, exist_ok=True)
 
 def iniciar_mejoras_finales():
     verificar_integridad()
     iniciar_backup_diario()
-    print("✅ Sistema IPH mejorado e inicializado correctamente.")
 
-iniciar_mejoras_finales()
+al_iniciar_sesion(iniciar_mejoras_finales)
 # ===================== FIN BLOQUE FINAL DE MEJORAS =====================
 # ===================== BLOQUE DE MEJORAS AVANZADAS =====================
 # Autor: ChatGPT - GPT-5
@@ -1475,12 +3793,8 @@ iniciar_mejoras_finales()
 import threading
 import datetime
 import sqlite3
-import pandas as pd
 import tkinter as tk
 from tkinter import messagebox, filedialog
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import folium
 import webbrowser
 import logging
 import hashlib
@@ -1526,37 +3840,17 @@ BACKUP_DIR = "backups_advanced"
 DB_NAME = "iph_database.db"
 
 def backup_avanzado():
-    """Backup con control de versiones, mantiene últimos 10."""
+    """Backup completo a través del programador único (mantiene los últimos 10)."""
     try:
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-        now = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        backup_file = os.path.join(BACKUP_DIR, f"backup_{now}.db")
-        conn = sqlite3.connect(DB_NAME)
-        bck = sqlite3.connect(backup_file)
-        with bck:
-            conn.backup(bck)
-        bck.close()
-        conn.close()
-        # Mantener solo últimos 10
-        backups = sorted(os.listdir(BACKUP_DIR))
-        for old in backups[:-10]:
-            os.remove(os.path.join(BACKUP_DIR, old))
-        log_event(f"Backup avanzado creado: {backup_file}")
+        backup_file = programador_backups.backup_completo()
+        if backup_file:
+            log_event(f"Backup avanzado creado: {backup_file}")
     except Exception as e:
         logging.error(f"Error backup avanzado: {e}")
 
 def iniciar_backup_diario():
-    """Inicia backup diario en hilo separado."""
-    def loop():
-        while True:
-            ahora = datetime.datetime.now()
-            siguiente = datetime.datetime.combine(ahora.date(), datetime.time(2,0))
-            if ahora > siguiente:
-                siguiente += datetime.timedelta(days=1)
-            segundos_espera = (siguiente - ahora).total_seconds()
-            threading.Event().wait(segundos_espera)
-            backup_avanzado()
-    threading.Thread(target=loop, daemon=True).start()
+    """Arranca el programador único de backups (idempotente)."""
+    programador_backups.iniciar()
 
 # -----------------------------
 # 3️⃣ OPTIMIZACIÓN DE INTERFAZ
@@ -1572,18 +3866,11 @@ def mostrar_notificacion_ui(titulo, mensaje):
 def estadisticas_iph_por_usuario():
     """Genera estadística de registros por usuario."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql("SELECT usuario, fecha FROM iph_records", conn)
-        conn.close()
-        if df.empty:
+        resumen = leer_estadisticas()["por_usuario"]
+        if resumen.empty:
             mostrar_notificacion_ui("Estadísticas", "No hay registros disponibles.")
             return
-        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
-        resumen = df.groupby("usuario").agg(
-            total_registros=("usuario","count"),
-            primer_registro=("fecha","min"),
-            ultimo_registro=("fecha","max")
-        ).reset_index()
+        resumen.columns = ["usuario", "total_registros", "primer_registro", "ultimo_registro"]
         archivo = f"estadisticas_usuarios_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         resumen.to_excel(archivo, index=False)
         mostrar_notificacion_ui("Estadísticas", f"Archivo generado: {archivo}")
@@ -1598,22 +3885,9 @@ def estadisticas_iph_por_usuario():
 def mapa_global_iph():
     """Genera mapa con coordenadas de registros IPH."""
     try:
-        conn = sqlite3.connect(DB_NAME)
-        df = pd.read_sql("SELECT detenido, coordenadas FROM iph_records WHERE coordenadas != ''", conn)
-        conn.close()
-        if df.empty:
+        if not mapa_global("mapa_global_iph.html"):
             mostrar_notificacion_ui("Mapa Global", "No hay registros con coordenadas.")
             return
-        m = folium.Map(location=[19.43, -99.13], zoom_start=6)
-        for _, row in df.iterrows():
-            try:
-                lat, lon = map(float, row["coordenadas"].split(","))
-                folium.Marker([lat, lon], popup=row["detenido"] or "Sin nombre").add_to(m)
-            except:
-                continue
-        archivo = "mapa_global_iph.html"
-        m.save(archivo)
-        webbrowser.open(archivo)
         log_event("Mapa global de registros generado.")
     except Exception as e:
         logging.error(f"Error mapa global: {e}")
@@ -1649,25 +3923,28 @@ def iniciar_mejoras_avanzadas():
     iniciar_backup_diario()
     log_event("Sistema IPH con mejoras avanzadas iniciado.")
 
-# Ejecutar mejoras al cargar el sistema
-iniciar_mejoras_avanzadas()
+# Ejecutar mejoras al iniciar sesión
+al_iniciar_sesion(iniciar_mejoras_avanzadas)
 
 # ===================== FIN BLOQUE MEJORAS AVANZADAS =====================
 
 # ===================== nuevo bloque =====================
 def conectar_base_datos():
     """Establece la conexión con la base de datos MySQL."""
+    # Los datos de conexión salen de CENTRAL_CONFIG; la captura no depende de esta conexión
+    # (los registros llegan a la central por la bandeja iph_salida y SincronizadorCentral).
     try:
-        conexion = mysql.connector.connect(
-            host='localhost',
-            database='nombre_base_datos',
-            user='usuario',
-            password='contraseña'
-        )
+        config = dict(leer_config_central() or {})
+        if config.pop("tipo", "mysql") != "mysql" or not config:
+            print(f"No hay base MySQL configurada en {CENTRAL_CONFIG}")
+            return None
+        for k in ("tabla", "estacion", "lote", "intervalo"):
+            config.pop(k, None)
+        conexion = DestinoMySQL(**config).conectar()
         if conexion.is_connected():
             print("Conexión exitosa a la base de datos")
             return conexion
-    except Error as e:
+    except Exception as e:
         print(f"Error al conectar a la base de datos: {e}")
         return None
 
@@ -1677,4 +3954,18 @@ def cerrar_conexion(conexion):
         conexion.close()
         print("Conexión cerrada")
 
+# -----------------------
+# Starter
+# -----------------------
+# Va al final para que todos los servicios de sesión estén registrados antes del login.
+DB_NAME = _DB_PRINCIPAL
+registrar_auditoria = _registrar_auditoria_principal
 
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    marcar_arranque("definiciones")
+    if "--verificar-backups" in sys.argv:
+        sys.exit(verificar_backups_cli())
+    if "--sincronizar" in sys.argv:
+        sys.exit(sincronizar_cli())
+    abrir_login()
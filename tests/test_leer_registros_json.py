@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+MODULO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "software_profesional - copia - copia.py")
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # El módulo crea carpetas en el directorio actual al importarse.
+    previo = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))
+    try:
+        spec = importlib.util.spec_from_file_location("software_profesional", MODULO)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        yield mod
+    finally:
+        os.chdir(previo)
+
+
+def _registros(n):
+    return [{"numero_informe": f"IPH-{i:03d}",
+             "detenidos": [{"nombre": f"Detenido {i}", "sexo": "Hombre"}],
+             "vehiculos": [{"tipo": "Terrestre", "marca": "X", "placa": f"P{i}", "serie": "S, [1]"}]}
+            for i in range(1, n + 1)]
+
+
+@pytest.mark.parametrize("tam_buffer", [7, 64, 1 << 20])
+def test_arreglo_indentado_valido(app, tmp_path, tam_buffer):
+    ruta = tmp_path / "ok.json"
+    ruta.write_text(json.dumps(_registros(5), ensure_ascii=False, indent=2), encoding="utf-8")
+    leidos = [rec for _, rec, _ in app.leer_registros_json(str(ruta), tam_buffer=tam_buffer)]
+    assert leidos == _registros(5)
+
+
+@pytest.mark.parametrize("tam_buffer", [7, 64, 1 << 20])
+def test_elemento_mal_formado_en_arreglo_indentado(app, tmp_path, tam_buffer):
+    texto = json.dumps(_registros(5), ensure_ascii=False, indent=2)
+    # quita la coma entre dos campos del cuarto registro
+    texto = texto.replace('"IPH-004",', '"IPH-004"', 1)
+    ruta = tmp_path / "roto.json"
+    ruta.write_text(texto, encoding="utf-8")
+    leidos = list(app.leer_registros_json(str(ruta), tam_buffer=tam_buffer))
+    assert [n for n, _, _ in leidos] == [1, 2, 3, 4, 5]
+    malos = [(n, rec) for n, rec, _ in leidos if isinstance(rec, Exception)]
+    assert len(malos) == 1
+    assert malos[0][0] == 4 and malos[0][1].numero_informe == "IPH-004"
+    assert [rec["numero_informe"] for _, rec, _ in leidos if isinstance(rec, dict)] == \
+        ["IPH-001", "IPH-002", "IPH-003", "IPH-005"]
+
+
+def test_ndjson_una_linea_mala(app, tmp_path):
+    lineas = [json.dumps(r, ensure_ascii=False) for r in _registros(3)]
+    lineas[1] = lineas[1][:-1]
+    ruta = tmp_path / "datos.ndjson"
+    ruta.write_text("\n".join(lineas) + "\n", encoding="utf-8")
+    leidos = list(app.leer_registros_json(str(ruta)))
+    assert [isinstance(rec, Exception) for _, rec, _ in leidos] == [False, True, False]
+    assert leidos[1][1].numero_informe == "IPH-002"